@@ -0,0 +1,181 @@
+import os
+import math
+import json
+import inspect
+import time
+import random
+import statistics
+import tracemalloc
+import heuristics
+import operations
+import questionary
+from tree import Tree
+from pathlib import Path
+from rich.table import Table
+from rich.console import Console
+
+def with_candidate(kind):
+    """ Returns a setup function which clones the tree and picks a random candidate of the given kind in the copy.
+    The setup returns `None` when the tree has no such candidate.
+    """
+
+    def setup(tree):
+        copy = tree.clone()
+        if not operations.count_candidates(copy.id)[kind]:
+            return None
+        candidate = operations.random_candidate(copy, kind)
+        if kind != operations.DISTRIBUTABLE:
+            return candidate
+        return random.choice([child for child in candidate.parent.children if child is not candidate]), candidate
+    return setup
+
+BENCHMARKS = [
+    ('Tree.parse', lambda tree: tree.formula, Tree.parse, 5, 1),
+    ('Tree.trim', lambda tree: tree.clone(), Tree.trim, 5, 1),
+    ('Tree.clone', lambda tree: tree, Tree.clone, 5, 1),
+    ('Tree.cost', lambda tree: tree, Tree.cost, 5, 1),
+    ('find_factorizable_lists', lambda tree: tree.clone(), operations.find_factorizable_lists, 5, 1),
+    ('find_absorbable_lists', lambda tree: tree.clone(), operations.find_absorbable_lists, 5, 1),
+    ('find_distributable_nodes', lambda tree: tree.clone(), operations.find_distributable_nodes, 5, 1),
+    ('factorize', with_candidate(operations.FACTORIZABLE), operations.factorize, 5, 1),
+    ('absorb', with_candidate(operations.ABSORBABLE), operations.absorb, 5, 1),
+    ('distribute', with_candidate(operations.DISTRIBUTABLE), lambda nodes: operations.distribute(*nodes), 5, 1),
+    ('decrease_cost', lambda tree: tree.clone(), operations.decrease_cost, 5, 1),
+    ('increase_cost', lambda tree: tree.clone(), operations.increase_cost, 5, 1)
+] + [
+    (name, lambda tree: tree.clone(), heuristic, 1, 0)
+    for name, heuristic in vars(heuristics).items()
+    if inspect.isfunction(heuristic) and heuristic.__module__ == 'heuristics' and name != 'iterate' and not name.startswith('_')
+]
+
+def measure(function, setup, tree, repeat, warmup):
+    """ Times `function` on the argument built by `setup(tree)`, which is excluded from the measurements.
+    After `warmup` untimed calls, it performs `repeat` timed calls with `time.perf_counter` and one more call under `tracemalloc`.
+    It returns the median running time in seconds and the peak memory in bytes, or `None` if `setup` found nothing to run on.
+    """
+
+    for _ in range(warmup):
+        arg = setup(tree)
+        if arg is None:
+            return None
+        function(arg)
+    times = []
+    for _ in range(repeat):
+        arg = setup(tree)
+        if arg is None:
+            return None
+        old_time = time.perf_counter()
+        function(arg)
+        times += [time.perf_counter() - old_time]
+    arg = setup(tree)
+    tracemalloc.start()
+    function(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+def run_benchmarks(trees, seed=618):
+    """ Runs every benchmark on every tree in `trees`, a dictionary from labels to trees.
+    It returns a dictionary mapping each benchmark to a dictionary from labels to `[cost, seconds, peak]` lists, or `None` for skipped runs.
+    """
+
+    results = dict()
+    for name, setup, function, repeat, warmup in BENCHMARKS:
+        results[name] = dict()
+        for label, tree in trees.items():
+            random.seed(seed)
+            measurement = measure(function, setup, tree, repeat, warmup)
+            results[name][label] = None if measurement is None else [tree.cost(), *measurement]
+    return results
+
+def scaling_exponent(points):
+    """ Returns the slope of the least-squares line through the points `(log(cost), log(seconds))`,
+    namely the `k` for which the running time grows like `cost^k`, or `None` if there are not enough points.
+    """
+
+    points = [(math.log(cost), math.log(seconds)) for cost, seconds, _ in points if seconds > 0]
+    if len(points) < 2:
+        return None
+    mean_x = statistics.mean([x for x, _ in points])
+    mean_y = statistics.mean([y for _, y in points])
+    variance = sum([(x - mean_x) ** 2 for x, _ in points])
+    if variance == 0:
+        return None
+    return sum([(x - mean_x) * (y - mean_y) for x, y in points]) / variance
+
+def regressions(results, baseline, time_tolerance=1.5, exponent_tolerance=.25, min_seconds=1e-4):
+    """ Compares `results` against `baseline` (both as returned by `run_benchmarks`) and returns a dictionary from benchmarks to problems.
+    A benchmark is flagged when its scaling exponent over the random sweep grew by more than `exponent_tolerance`,
+    or when it got more than `time_tolerance` times slower on any of the inputs; timings below `min_seconds` are too noisy to compare.
+    """
+
+    problems = dict()
+    for name, measurements in results.items():
+        if name not in baseline:
+            continue
+        messages = []
+        sweep = [measurement for label, measurement in measurements.items() if label.isdecimal() and measurement is not None]
+        baseline_sweep = [measurement for label, measurement in baseline[name].items() if label.isdecimal() and measurement is not None]
+        exponent = scaling_exponent(sweep)
+        baseline_exponent = scaling_exponent(baseline_sweep)
+        if exponent is not None and baseline_exponent is not None and exponent > baseline_exponent + exponent_tolerance:
+            messages += [f'scaling exponent {baseline_exponent:.2f} -> {exponent:.2f}']
+        for label, measurement in measurements.items():
+            baseline_measurement = baseline[name].get(label)
+            if measurement is None or baseline_measurement is None:
+                continue
+            if measurement[1] > max(min_seconds, time_tolerance * baseline_measurement[1]):
+                messages += [f'{label}: {baseline_measurement[1] * 1000:.2f}ms -> {measurement[1] * 1000:.2f}ms']
+        if messages:
+            problems[name] = messages
+    return problems
+
+def build_trees(variable_counts=(16, 32, 64, 128), max_degree=4, seed=618):
+    """ Builds the benchmark inputs: one `Tree.random` tree for each variable count, labeled by the count,
+    and the first formula of every file in the shipped datasets, labeled by `{dataset}/{filename}`.
+    """
+
+    random.seed(seed)
+    trees = {str(variable_count): Tree.random(variable_count, max_degree) for variable_count in variable_counts}
+    path = Path('inputs')
+    for dataset in sorted([entry.name for entry in os.scandir(path) if entry.is_dir()]):
+        for filename in sorted([entry.name for entry in os.scandir(path / dataset) if entry.is_file() and entry.name.endswith('.txt')]):
+            with open(path / dataset / filename, 'r') as fd:
+                formula = next((line.strip() for line in fd if line.strip() != ''), None)
+            if formula is not None:
+                trees[f'{dataset}/{filename[0:-4]}'] = Tree.parse(formula)
+    return trees
+
+if __name__ == '__main__':
+    baseline_path = Path('benchmarks.json')
+    console = Console()
+    with console.status('Running benchmarks...'):
+        trees = build_trees()
+        results = run_benchmarks(trees)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else dict()
+    problems = regressions(results, baseline)
+
+    table = Table(title='Benchmarks (median time in ms, peak memory of the largest random input in KiB)', header_style='bold green')
+    table.add_column('Benchmark', justify='left')
+    for label, tree in trees.items():
+        table.add_column(f'{label}\n({tree.cost()} literals)', justify='right')
+    table.add_column('Scaling Exponent', justify='right')
+    table.add_column('Peak Memory (KiB)', justify='right')
+    table.add_column('Status', justify='left')
+    for name, measurements in results.items():
+        sweep = [measurement for label, measurement in measurements.items() if label.isdecimal() and measurement is not None]
+        exponent = scaling_exponent(sweep)
+        table.add_row(
+            name,
+            *['-' if measurement is None else '{:.3f}'.format(measurement[1] * 1000) for measurement in measurements.values()],
+            '-' if exponent is None else '{:.2f}'.format(exponent),
+            '-' if not sweep else '{:.1f}'.format(sweep[-1][2] / 1024),
+            '[red]' + '; '.join(problems[name]) + '[/red]' if name in problems else '[green]ok[/green]' if name in baseline else 'no baseline'
+        )
+
+    console.print()
+    console.print(table)
+    console.print()
+    if questionary.confirm('Save these results as the new baseline?', default=not baseline).ask():
+        baseline_path.write_text(json.dumps(results, indent=4))
+        console.print(f'Baseline saved to [yellow]{baseline_path}[/yellow]! 🎉')
@@ -0,0 +1,64 @@
+import json
+import sqlite3
+
+class Cache:
+    """ Used for persisting the results of the runs across invocations of `main.py` in an SQLite database.
+    It stores the following two tables:
+    1. `runs` the result of every run, keyed by the canonical formula, the heuristic (as given by `main.heuristic_key`), the seed, and the formula the run was warm-started from
+    (the empty string for cold starts), so the same formula is never optimized twice with the same parameters, whichever file it comes from
+    2. `best` the best formula found so far for every canonical formula, together with its cost, used for warm-starting the heuristics
+
+    The results are stored as returned by `main.run_iteration`.
+    Since the heuristics are identified by their name and the default values of their parameters only, the cache should be deleted after changing their code.
+    """
+
+    def __init__(self, path):
+        """ Opens the database at `path`, creating it if needed. """
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                formula TEXT, heuristic TEXT, seed TEXT, start TEXT,
+                improvement REAL, runningtime REAL, result TEXT, certified INTEGER, profile TEXT,
+                PRIMARY KEY (formula, heuristic, seed, start)
+            )
+        ''')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS best (formula TEXT PRIMARY KEY, result TEXT, cost INTEGER)')
+        self.connection.commit()
+
+    def get(self, formula, heuristic, seed, start=None):
+        """ Returns the stored result of the run with the given parameters, or `None` if it was never stored. """
+        row = self.connection.execute(
+            'SELECT improvement, runningtime, result, certified, profile FROM runs WHERE formula = ? AND heuristic = ? AND seed = ? AND start = ?',
+            (formula, heuristic, seed, start or '')
+        ).fetchone()
+        if row is None:
+            return None
+        improvement, runningtime, result, certified, profile = row
+        return improvement, runningtime, result, None if certified is None else bool(certified), None if profile is None else json.loads(profile)
+
+    def put(self, formula, heuristic, seed, start, result, cost):
+        """ Stores the result of a run, whose resulting formula has `cost` literals, and updates the best formula known for `formula`.
+        Formulas which were not certified to be equivalent to the initial one are never used as best formulas.
+        """
+
+        improvement, runningtime, new_formula, certified, profile = result
+        self.connection.execute(
+            'INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (formula, heuristic, seed, start or '', improvement, runningtime, new_formula, None if certified is None else int(certified), None if profile is None else json.dumps(profile))
+        )
+        if certified:
+            self.connection.execute('''
+                INSERT INTO best VALUES (?, ?, ?)
+                ON CONFLICT (formula) DO UPDATE SET result = excluded.result, cost = excluded.cost WHERE excluded.cost < best.cost
+            ''', (formula, new_formula, cost))
+        self.connection.commit()
+
+    def best(self, formula):
+        """ Returns the best formula known to be equivalent to `formula`, or `None` if there is none. """
+        row = self.connection.execute('SELECT result FROM best WHERE formula = ?', (formula,)).fetchone()
+        return None if row is None else row[0]
+
+    def close(self):
+        """ Closes the database. """
+        self.connection.close()
@@ -0,0 +1,68 @@
+from tree import Tree
+
+class Dag:
+    """ Used for measuring formulas as circuits, in which every distinct subformula is a single gate or input shared by all its uses.
+    It follows one formula at a time, which it identifies by its id, and stores the following data:
+    1. `root` the id of the formula currently followed, or `None` before the first call
+    2. `references` the number of references to every distinct subformula of it, from the distinct gates using it (or from the outside, for the root)
+
+    The subformulas are the ones interned by `Tree`, so the circuit needs no storage of its own besides the reference counts.
+    Its cost is the number of distinct subformulas, namely every gate and every literal counted once, however many times it is used.
+    When the formula changes, only the subformulas gaining their first reference or losing their last one are visited,
+    so following a heuristic takes time proportional to the size of its edits, since the untouched subformulas are shared.
+    A `Dag` can be passed as the `cost` of the heuristics that accept one, to minimize the circuits instead of the number of literals.
+    """
+
+    def __init__(self):
+        """ Constructs a circuit following no formula yet. """
+        self.root = None
+        self.references = dict()
+
+    def __call__(self, tree):
+        """ Follows the formula of `tree` and returns its cost as a circuit. """
+        if tree.id != self.root:
+            self.acquire(tree.id)
+            if self.root is not None:
+                self.release(self.root)
+            self.root = tree.id
+        return len(self.references)
+
+    def acquire(self, id):
+        """ Adds a reference to the subformula identified by `id`, together with the references from its gates, if it was not used before. """
+        stack = [id]
+        while stack:
+            id = stack.pop()
+            self.references[id] = self.references.get(id, 0) + 1
+            if self.references[id] == 1 and Tree.keys[id][0] != '?':
+                stack += Tree.keys[id][1]
+
+    def release(self, id):
+        """ Removes a reference to the subformula identified by `id`, together with the references from its gates, if it is not used anymore. """
+        stack = [id]
+        while stack:
+            id = stack.pop()
+            self.references[id] -= 1
+            if self.references[id] == 0:
+                self.references.pop(id)
+                if Tree.keys[id][0] != '?':
+                    stack += Tree.keys[id][1]
+
+    def shared(self):
+        """ Returns the ids of the gates used more than once, which a formula would have to repeat. """
+        return [id for id, count in self.references.items() if count > 1 and Tree.keys[id][0] != '?']
+
+    def netlist(self):
+        """ Returns the circuit as text, with one line `gN = ...` for every distinct gate, after the lines of the gates it uses (or the literal, if there is no gate).
+        The inputs of every gate are its literals and the names of the gates below it, ordered by their structural digest.
+        """
+
+        names = dict()
+        lines = []
+        for id in Tree.postorder([self.root]):
+            gate, arg = Tree.keys[id]
+            if gate == '?':
+                names[id] = Tree.variables[arg]
+            else:
+                names[id] = f'g{len(lines) + 1}'
+                lines += [names[id] + ' = ' + gate.join([names[child_id] for child_id in sorted(arg, key=lambda child_id: Tree.digests[child_id])])]
+        return '\n'.join(lines) if lines else names[self.root]
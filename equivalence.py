@@ -0,0 +1,163 @@
+from tree import Tree
+
+class BDD:
+    """ Used for representing Boolean functions as Reduced Ordered Binary Decision Diagrams sharing a single manager.
+    Nodes are referred to by their index in `nodes`, where `0` and `1` are the `FALSE` and `TRUE` terminals.
+    Every other node is a triple `(level, low, high)`, where `level` is the position of its variable in the ordering.
+    The triples are hash-consed in `unique`, so two functions are equivalent if and only if they are represented by the same index.
+    The results of `apply` are memoized in `cache`.
+    Since some functions have no small diagram under any ordering, the manager refuses to grow beyond `max_nodes` nodes.
+    """
+
+    def __init__(self, order, max_nodes=500000):
+        """ Constructs an empty manager for the given variable ordering. """
+        self.max_nodes = max_nodes
+        self.levels = {variable_id: level for level, variable_id in enumerate(order)}
+        self.nodes = [(len(order), 0, 0), (len(order), 1, 1)]
+        self.unique = dict()
+        self.cache = dict()
+
+    def node(self, level, low, high):
+        """ Returns the index of the node `(level, low, high)`, creating it if needed; redundant tests are skipped. """
+        if low == high:
+            return low
+        key = level, low, high
+        if key not in self.unique:
+            if len(self.nodes) >= self.max_nodes:
+                raise OverflowError(f'the BDD exceeded {self.max_nodes} nodes')
+            self.unique[key] = len(self.nodes)
+            self.nodes += [key]
+        return self.unique[key]
+
+    def variable(self, variable_id):
+        """ Returns the index of the node representing the function of the variable with the given id. """
+        return self.node(self.levels[variable_id], 0, 1)
+
+    def apply(self, gate, u, v):
+        """ Returns the index of the node representing `u*v` if `gate == '*'`, or `u+v` if `gate == '+'`.
+        The pairs of cofactors are combined with an explicit stack, so the depth of the diagrams is only bounded by the available memory.
+        """
+
+        absorbing, neutral = (0, 1) if gate == '*' else (1, 0)
+        results = []
+        stack = [(u, v, False)]
+        while stack:
+            u, v, expanded = stack.pop()
+            if expanded:
+                high = results.pop()
+                low = results.pop()
+                self.cache[gate, u, v] = self.node(min(self.nodes[u][0], self.nodes[v][0]), low, high)
+                results += [self.cache[gate, u, v]]
+                continue
+            if u == absorbing or v == absorbing:
+                results += [absorbing]
+                continue
+            if u == neutral or u == v:
+                results += [v]
+                continue
+            if v == neutral:
+                results += [u]
+                continue
+            if u > v:
+                u, v = v, u
+            if (gate, u, v) in self.cache:
+                results += [self.cache[gate, u, v]]
+                continue
+            level_u, low_u, high_u = self.nodes[u]
+            level_v, low_v, high_v = self.nodes[v]
+            level = min(level_u, level_v)
+            if level_u > level:
+                low_u, high_u = u, u
+            if level_v > level:
+                low_v, high_v = v, v
+            stack += [(u, v, True), (high_u, high_v, False), (low_u, low_v, False)]
+        return results.pop()
+
+    def build(self, tree):
+        """ Returns the index of the node representing the formula of `tree`, building every distinct subformula once.
+        The children of every gate are combined from the one testing the deepest variable up, so the intermediate diagrams only grow at the top.
+        """
+
+        built = dict()
+        for id in Tree.postorder([tree.id]):
+            gate, arg = Tree.keys[id]
+            if gate == '?':
+                built[id] = self.variable(arg)
+            else:
+                node = 1 if gate == '*' else 0
+                for child in sorted([built[child_id] for child_id in arg], key=lambda child: -self.nodes[child][0]):
+                    node = self.apply(gate, node, child)
+                built[id] = node
+        return built[tree.id]
+
+def variable_order(*trees):
+    """ Returns the ids of the variables of the given trees in the order of their first occurrence in a depth-first traversal visiting bigger subformulas first.
+    Variables appearing close to each other in the formula end up close to each other in the ordering,
+    which is a classic heuristic for keeping decision diagrams small.
+    """
+
+    order = dict()
+    visited = set()
+    stack = [tree.id for tree in reversed(trees)]
+    while stack:
+        id = stack.pop()
+        if id in visited:
+            continue
+        visited |= {id}
+        gate, arg = Tree.keys[id]
+        if gate == '?':
+            order.setdefault(arg, len(order))
+        else:
+            stack += reversed(sorted(arg, key=lambda child_id: -Tree.costs[child_id]))
+    return list(order)
+
+def truth_table(tree, order):
+    """ Returns the truth table of `tree` over the variables in `order` as a `2^len(order)`-bit integer.
+    The bit `j` is the value of the formula when each variable with the id `order[i]` takes the value of the bit `i` of `j`.
+    """
+
+    size = 1 << len(order)
+    patterns = dict()
+    for index, variable_id in enumerate(order):
+        width = 1 << index
+        pattern = ((1 << width) - 1) << width
+        width *= 2
+        while width < size:
+            pattern |= pattern << width
+            width *= 2
+        patterns[variable_id] = pattern
+    mask = (1 << size) - 1
+    values = dict()
+    for id in Tree.postorder([tree.id]):
+        gate, arg = Tree.keys[id]
+        if gate == '?':
+            values[id] = patterns[arg]
+        elif gate == '*':
+            value = mask
+            for child_id in arg:
+                value &= values[child_id]
+            values[id] = value
+        else:
+            value = 0
+            for child_id in arg:
+                value |= values[child_id]
+            values[id] = value
+    return values[tree.id]
+
+def equivalent(tree1, tree2, max_table_variables=16, max_nodes=500000):
+    """ Checks exactly whether the formulas represented by `tree1` and `tree2` are equivalent.
+    If there are at most `max_table_variables` variables, it compares the exhaustive truth tables as bitsets.
+    Otherwise, it compares the canonical BDDs of the two formulas built in a shared manager.
+    It returns `None` if the answer is unknown because the BDDs would need more than `max_nodes` nodes.
+    """
+
+    if tree1.id == tree2.id:
+        return True
+    order = variable_order(tree1, tree2)
+    if len(order) <= max_table_variables:
+        return truth_table(tree1, order) == truth_table(tree2, order)
+    bdd = BDD(order, max_nodes)
+    try:
+        return bdd.build(tree1) == bdd.build(tree2)
+    except OverflowError:
+        return None
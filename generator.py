@@ -1,38 +1,59 @@
 import os
-import time
 import random
+import itertools
 import questionary
 from tree import Tree
 from pathlib import Path
 from rich.console import Console
+from rich.progress import Progress
+from concurrent.futures import ProcessPoolExecutor
 
-path = Path('inputs')
-subdirnames = [entry.name for entry in os.scandir(path) if entry.is_dir()]
-subdirname = questionary.select('Choose dataset directory', subdirnames + ['[new]'], '[new]').ask()
-if subdirname == '[new]':
-    subdirname = questionary.text('Enter new dataset name', 'dataset', validate=lambda val: val != '').ask()
-path /= subdirname
+def generate_formula(seed, variable_counts, max_degrees, literal_counts):
+    """ Returns a random formula built by `Tree.random_sized`, after seeding the random generator of the current process with `seed`.
+    Its number of variables, maximum degree and number of literals are drawn from the given inclusive ranges.
+    This is the unit of work shipped to the worker processes by `generate_formulas`.
+    Since the worker processes live as long as `generate_formulas`, it starts by emptying the tables of interned subformulas left by the previous formulas,
+    which invalidates all the trees of the current process.
+    """
 
-filename = questionary.text('Enter filename', 'formulas', validate=lambda val: val != '').ask()
-min_variable_count = int(questionary.text('Enter min_variable_count', '10', validate=lambda val: val.isdecimal() and int(val) >= 1).ask())
-max_variable_count = int(questionary.text('Enter max_variable_count', str(min_variable_count), validate=lambda val: val.isdecimal() and int(val) >= min_variable_count).ask())
-min_max_degree = int(questionary.text('Enter min_max_degree', '2', validate=lambda val: val.isdecimal() and int(val) >= 2).ask())
-max_max_degree = int(questionary.text('Enter max_max_degree', str(min_max_degree), validate=lambda val: val.isdecimal() and int(val) >= min_max_degree).ask())
-min_literal_count = int(questionary.text('Enter min_literal_count', '10', validate=lambda val: val.isdecimal() and int(val) >= 1).ask())
-max_literal_count = int(questionary.text('Enter max_literal_count', str(min_literal_count), validate=lambda val: val.isdecimal() and int(val) >= min_literal_count).ask())
-formula_count = int(questionary.text('Enter formula_count', '25', validate=lambda val: val.isdecimal() and int(val) >= 1).ask())
+    Tree.clear()
+    random.seed(seed)
+    return Tree.random_sized(random.randint(*variable_counts), random.randint(*max_degrees), random.randint(*literal_counts)).formula
 
-formulas = []
-while len(formulas) < formula_count:
-    tree = Tree.random(random.randint(min_variable_count, max_variable_count), random.randint(min_max_degree, max_max_degree))
-    if min_literal_count <= tree.cost() <= max_literal_count:
-        formulas += [tree.formula]
+def generate_formulas(formula_count, variable_counts, max_degrees, literal_counts, workers=os.cpu_count(), seed=618):
+    """ Lazily yields `formula_count` random formulas, generated in batches on a pool of `workers` processes.
+    The formula `i` is seeded with `{seed}/{i}`, so the formulas depend neither on the number of workers nor on the batching.
+    """
 
-console = Console()
-with console.status('Generating formulas...'):
+    batch_size = 16 * workers
+    with ProcessPoolExecutor(workers) as executor:
+        for start in range(0, formula_count, batch_size):
+            seeds = [f'{seed}/{index}' for index in range(start, min(start + batch_size, formula_count))]
+            yield from executor.map(generate_formula, seeds, itertools.repeat(variable_counts), itertools.repeat(max_degrees), itertools.repeat(literal_counts))
+
+if __name__ == '__main__':
+    path = Path('inputs')
+    subdirnames = [entry.name for entry in os.scandir(path) if entry.is_dir()]
+    subdirname = questionary.select('Choose dataset directory', subdirnames + ['[new]'], '[new]').ask()
+    if subdirname == '[new]':
+        subdirname = questionary.text('Enter new dataset name', 'dataset', validate=lambda val: val != '').ask()
+    path /= subdirname
+
+    filename = questionary.text('Enter filename', 'formulas', validate=lambda val: val != '').ask()
+    min_variable_count = int(questionary.text('Enter min_variable_count', '10', validate=lambda val: val.isdecimal() and int(val) >= 1).ask())
+    max_variable_count = int(questionary.text('Enter max_variable_count', str(min_variable_count), validate=lambda val: val.isdecimal() and int(val) >= min_variable_count).ask())
+    min_max_degree = int(questionary.text('Enter min_max_degree', '2', validate=lambda val: val.isdecimal() and int(val) >= 2).ask())
+    max_max_degree = int(questionary.text('Enter max_max_degree', str(min_max_degree), validate=lambda val: val.isdecimal() and int(val) >= min_max_degree).ask())
+    min_literal_count = int(questionary.text('Enter min_literal_count', '10', validate=lambda val: val.isdecimal() and int(val) >= 1).ask())
+    max_literal_count = int(questionary.text('Enter max_literal_count', str(min_literal_count), validate=lambda val: val.isdecimal() and int(val) >= min_literal_count).ask())
+    formula_count = int(questionary.text('Enter formula_count', '25', validate=lambda val: val.isdecimal() and int(val) >= 1).ask())
+
+    console = Console()
     path.mkdir(parents=True, exist_ok=True)
-    with open(path / f'{filename}.txt', 'w') as fd:
+    with Progress() as progress, open(path / f'{filename}.txt', 'w') as fd:
+        task = progress.add_task('Generating formulas...', total=formula_count)
+        formulas = generate_formulas(formula_count, (min_variable_count, max_variable_count), (min_max_degree, max_max_degree), (min_literal_count, max_literal_count))
         for formula in formulas:
             fd.write(formula + '\n')
-    time.sleep(3)
+            progress.advance(task)
     console.print(f'Formula file [yellow]{filename}[/yellow] successfully generated in dataset [yellow]{subdirname}[/yellow]! 🎉')
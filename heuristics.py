@@ -1,68 +1,354 @@
 import math
+import time
 import random
+import itertools
 import operations
+from tree import Tree
 
-def naive(tree):
-    """ Just applies factorizations and absorptions on `tree` as long as possible. """
+class Budget:
+    """ Used for running the heuristics in anytime mode, under a limit of wall-clock seconds and/or operations.
+    It stores the following data:
+    1. `start` and `deadline` the moments (as given by `time.monotonic`) when the budget was created and when it runs out of time, if ever
+    2. `operations` the number of operations that can be performed, if limited, and `used` the number of operations performed so far
+    3. `best` a constant-time copy of the best tree seen so far, which is never shipped to other processes
+    4. `trace` the list of `(seconds, cost)` pairs recording every improvement of the best cost seen so far, for comparing heuristics at equal compute
+    5. `cost` the function measuring the trees, which is `Tree.cost` unless the heuristic minimizes another cost, like the one of a `dag.Dag`,
+    and `best_cost` the cost of `best`
+
+    The heuristics call `step` after their operations, stop as soon as it reports the budget as exhausted, and finish by calling `restore`.
+    """
+
+    def __init__(self, seconds=None, operations=None, cost=Tree.cost):
+        """ Constructs a budget of `seconds` seconds and `operations` operations, starting now; `None` means unlimited. """
+        self.start = time.monotonic()
+        self.deadline = None if seconds is None else self.start + seconds
+        self.operations = operations
+        self.used = 0
+        self.best = None
+        self.trace = []
+        self.cost = cost
+        self.best_cost = None
+
+    def __getstate__(self):
+        return {**vars(self), 'best': None}
+
+    def step(self, tree, count=1):
+        """ Records `count` more operations which led to `tree`, and returns whether the budget is exhausted. """
+        self.used += count
+        cost = self.cost(tree)
+        if self.best is None or cost < self.best_cost:
+            self.best = tree.clone()
+            self.best_cost = cost
+            self.trace += [(time.monotonic() - self.start, cost)]
+        return self.exhausted()
+
+    def exhausted(self):
+        """ Checks whether the time or the operations ran out. """
+        if self.operations is not None and self.used >= self.operations:
+            return True
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def restore(self, tree):
+        """ Assigns to `tree` the best tree seen so far, if it is better than `tree`. """
+        if self.best is not None and self.best_cost < self.cost(tree):
+            tree.assign(self.best)
+
+    def split(self, count):
+        """ Returns `count` budgets sharing the start and the deadline of this one, among which the remaining operations are divided evenly. """
+        budgets = []
+        for index in range(count):
+            budget = Budget(cost=self.cost)
+            budget.start = self.start
+            budget.deadline = self.deadline
+            if self.operations is not None:
+                remaining = max(self.operations - self.used, 0)
+                budget.operations = remaining // count + (index < remaining % count)
+            budgets += [budget]
+        return budgets
+
+    def share(self, count):
+        """ Returns the deadline of the next of `count` runs performed one after another, which gets an even share of the time left, if limited. """
+        if self.deadline is None:
+            return None
+        now = time.monotonic()
+        return min(self.deadline, now + max(self.deadline - now, 0) / count)
+
+    def merge(self, budgets):
+        """ Adds up the operations used by the given budgets, split from this one, and merges their traces into the trace of this one. """
+        self.used += sum([budget.used for budget in budgets])
+        trace = sorted(self.trace + [point for budget in budgets for point in budget.trace])
+        self.trace = []
+        for seconds, cost in trace:
+            if not self.trace or cost < self.trace[-1][1]:
+                self.trace += [(seconds, cost)]
+
+def naive(tree, budget=None):
+    """ Just applies factorizations and absorptions on `tree` as long as possible, or until `budget` is exhausted. """
+    if budget is not None:
+        budget.step(tree, 0)
     while operations.decrease_cost(tree):
-        pass
+        if budget is not None and budget.step(tree):
+            break
 
-def hill_climbing(tree, neighbors=10):
+def _descend(tree, cost=Tree.cost, patience=10, table=None, budget=None):
+    """ Applies factorizations and absorptions on `tree` as long as possible, undoing the ones which increase `cost`,
+    until `patience` of them in a row are undone or `budget` is exhausted.
+    With the default cost, no move is ever undone, since factorizations and absorptions never increase the number of literals.
+    """
+
+    rejected = 0
+    while rejected < patience:
+        old_cost = cost(tree)
+        applied, journal = operations.apply(operations.decrease_cost, tree, table)
+        if not applied:
+            break
+        if cost(tree) > old_cost:
+            Tree.undo(journal)
+            rejected += 1
+        else:
+            rejected = 0
+        if budget is not None and budget.step(tree):
+            break
+
+def _neighbor(formula, seed):
+    """ Returns the cost and the formula of the neighbor obtained by randomly applying one factorization or absorption on the tree of `formula`
+    after seeding the random generator with `seed`, or `None` if no operation can be applied.
+    This is the unit of work shipped to the executor by `hill_climbing`.
+    Since the worker processes of the executor outlive it, it starts by emptying the tables of interned subformulas and the counts of candidates,
+    which invalidates all the trees of the current process.
+    """
+
+    Tree.clear()
+    operations.clear_counts()
+    random.seed(seed)
+    tree = Tree.parse(formula)
+    if not operations.decrease_cost(tree):
+        return None
+    return tree.cost(), tree.formula
+
+def hill_climbing(tree, neighbors=10, table=None, executor=None, budget=None, cost=Tree.cost):
     """ Performs Hill Climbing on `tree`.
     The neighbors of the current state are obtained by randomly applying `neighbors` factorizations and absorptions on `tree`.
+    Each neighbor is applied in place and then rolled back, keeping only a constant-time copy of the best one.
+    If `table` (an `operations.TranspositionTable`) is given, the neighbors already generated from a known state are looked up instead of being applied again.
+    Every neighbor is generated with its own seed drawn from the random generator, so if `executor` (like a `ProcessPoolExecutor`) is given,
+    the neighbors are generated concurrently on it from the formula of the current state, with the same result regardless of the number of workers.
+    Its workers do not share `table`, so giving both raises a `ValueError`.
+    If `budget` is given, every neighbor counts as an operation, and the climb stops as soon as the budget is exhausted.
+    The best neighbor is the one with the lowest `cost`, which can be a `dag.Dag` for minimizing circuits; it is never worse than the current state.
     """
+    if table is not None and executor is not None:
+        raise ValueError('the neighbors generated on an executor cannot be looked up in a table')
+    if budget is not None:
+        budget.step(tree, 0)
     while True:
-        best_cost = 1e9
+        seeds = [random.getrandbits(64) for _ in range(neighbors)]
+        if executor is not None:
+            results = list(executor.map(_neighbor, itertools.repeat(tree.formula), seeds))
+            if None in results: return
+            best_tree = min([Tree.parse(formula) for _, formula in results], key=cost)
+            if cost(best_tree) > cost(tree): return
+            tree.assign(best_tree)
+            if budget is not None and budget.step(tree, neighbors): return
+            continue
+        state = random.getstate()
+        best_cost = cost(tree)
         best_tree = None
-        for _ in range(neighbors):
-            copy = tree.clone()
-            if not operations.decrease_cost(copy): return
-            cost = copy.cost()
-            if cost < best_cost:
-                best_cost = cost
-                best_tree = copy
+        applied = True
+        for seed in seeds:
+            random.seed(seed)
+            applied, journal = operations.apply(operations.decrease_cost, tree, table)
+            if not applied: break
+            new_cost = cost(tree)
+            if best_tree is None and new_cost <= best_cost or new_cost < best_cost:
+                best_cost = new_cost
+                best_tree = tree.clone()
+            Tree.undo(journal)
+        random.setstate(state)
+        if not applied or best_tree is None: return
         tree.assign(best_tree)
+        if budget is not None and budget.step(tree, neighbors): return
 
-def simulated_annealing(tree, t_min=.1, t_max=1, cooling_rate=.05, increase_prob=.2, steps=10):
-    """ Performs Simulated Annealing on `tree`. """
+def best_improvement_hill_climbing(tree, budget=None):
+    """ Performs Hill Climbing on `tree` by always choosing the best neighbor.
+    Every factorization and absorption is ranked by its exact cost delta, and only the winning one is actually applied.
+    If `budget` is given, every ranked move counts as an operation, and the climb stops as soon as the budget is exhausted.
+    """
+    if budget is not None:
+        budget.step(tree, 0)
+    while True:
+        moves = [(operations.factorization_delta(nodes), operations.factorize, nodes) for nodes in operations.find_factorizable_lists(tree)]
+        moves += [(operations.absorption_delta(nodes), operations.absorb, nodes) for nodes in operations.find_absorbable_lists(tree)]
+        if not moves: return
+        _, operation, nodes = min(moves, key=lambda move: move[0])
+        Tree.retrim(operation(nodes))
+        if budget is not None and budget.step(tree, len(moves)): return
+
+def simulated_annealing(tree, t_min=.1, t_max=1, cooling_rate=.05, increase_prob=.2, steps=10, table=None, budget=None, cost=Tree.cost):
+    """ Performs Simulated Annealing on `tree`.
+    Moves are applied in place and rolled back through their undo journal when rejected.
+    If `table` (an `operations.TranspositionTable`) is given, the factorizations and absorptions already tried in a known state are looked up instead of being applied again.
+    If `budget` is given, the annealing stops as soon as the budget is exhausted, and `tree` ends up as the best tree seen.
+    The moves are accepted according to `cost`, which can be a `dag.Dag` for minimizing circuits, in which case the budget needs the same cost.
+    The final descent only keeps the factorizations and absorptions which do not increase `cost`.
+    With any other cost than the default one, like the one of a circuit, which the moves are not designed for, the annealing can drift away
+    from the best state it saw, so that state is tracked by id and restored before the final descent; the default cost keeps the algorithm of the paper.
+    """
+    if budget is not None:
+        budget.step(tree, 0)
+    best_id = tree.id
+    best_cost = cost(tree)
     t = t_max
     while t > t_min:
         for _ in range(steps):
-            copy = tree.clone()
-            old_cost = copy.cost()
+            old_cost = cost(tree)
             if random.random() < increase_prob:
-                operations.increase_cost(copy)
+                _, journal = operations.apply(operations.increase_cost, tree)
             else:
-                operations.decrease_cost(copy)
-            new_cost = copy.cost()
+                _, journal = operations.apply(operations.decrease_cost, tree, table)
+            new_cost = cost(tree)
             delta = (new_cost - old_cost) / old_cost
-            if delta < 0 or random.random() < math.exp(-delta / t):
-                tree.assign(copy)
+            if not (delta < 0 or random.random() < math.exp(-delta / t)):
+                Tree.undo(journal)
+            elif cost is not Tree.cost and new_cost < best_cost:
+                best_id = tree.id
+                best_cost = new_cost
+            if budget is not None and budget.step(tree):
+                budget.restore(tree)
+                return
         t /= 1 + cooling_rate * t
-    while operations.decrease_cost(tree):
-        pass
+    if cost is not Tree.cost and best_cost < cost(tree):
+        tree.assign(Tree.from_id(best_id))
+    _descend(tree, cost, steps, table, budget)
+    if budget is not None:
+        budget.restore(tree)
 
-def custom_heuristic(tree, alpha=5, steps=150):
-    """ Performs our Custom Heuristic algorithm on `tree`. """
+def custom_heuristic(tree, alpha=5, steps=150, table=None, budget=None):
+    """ Performs our Custom Heuristic algorithm on `tree`.
+    If `table` (an `operations.TranspositionTable`) is given, the factorizations and absorptions already tried in a known state are looked up instead of being applied again.
+    If `budget` is given, the algorithm stops as soon as the budget is exhausted, and `tree` ends up as the best tree seen.
+    """
+    if budget is not None:
+        budget.step(tree, 0)
     can_factorize = True
     for step in range(steps):
         if not can_factorize or random.randrange(alpha * steps) < steps - step:
             operations.increase_cost(tree)
             can_factorize = True
-        elif not operations.decrease_cost(tree):
+        elif not operations.decrease_cost(tree, table):
             can_factorize = False
-    while operations.decrease_cost(tree):
-        pass
-
-def iterate(tree, heuristic, iterations=10):
-    """ Performs `iterations` runs of `heuristic` on `tree` and assigns to it the best result. """
-    best_cost = 1e9
-    best_tree = None
-    for _ in range(iterations):
-        copy = tree.clone()
-        heuristic(copy)
-        cost = copy.cost()
-        if cost < best_cost:
-            best_cost = cost
-            best_tree = copy
-    tree.assign(best_tree)
+        if budget is not None and budget.step(tree):
+            budget.restore(tree)
+            return
+    while operations.decrease_cost(tree, table):
+        if budget is not None and budget.step(tree):
+            break
+    if budget is not None:
+        budget.restore(tree)
+
+def parallel_tempering(tree, population=8, t_min=.02, t_max=.5, increase_prob=.2, steps=10, sweeps=20, table=None, budget=None):
+    """ Performs Parallel Tempering on `tree`.
+    A population of `population` replicas of `tree` is annealed at fixed temperatures spaced geometrically from `t_min` to `t_max`,
+    every replica doing `steps` moves of Simulated Annealing per sweep, for `sweeps` sweeps.
+    After every sweep, the replicas at neighboring temperatures exchange their states with the usual Metropolis criterion,
+    so the best states sink to the coldest replicas, while the hottest ones keep escaping from the basins the others converged to.
+    The replicas are only kept as ids, so all their identical subformulas are shared in the interned tables of `Tree`,
+    and each of them is materialized lazily, only along the paths touched by its own moves.
+    Finally, the best state seen is descended with factorizations and absorptions and assigned to `tree`.
+    If `table` (an `operations.TranspositionTable`) is given, it is shared by all the replicas, which often revisit the same states.
+    If `budget` is given, every move counts as an operation, and `tree` ends up as the best tree seen as soon as the budget is exhausted.
+    """
+    if budget is not None:
+        budget.step(tree, 0)
+    initial_cost = tree.cost()
+    temperatures = [t_min * (t_max / t_min) ** (index / max(population - 1, 1)) for index in range(population)]
+    replicas = [tree.id] * population
+    best_id = tree.id
+    for _ in range(sweeps):
+        for index, t in enumerate(temperatures):
+            replica = Tree.from_id(replicas[index])
+            for _ in range(steps):
+                old_cost = replica.cost()
+                if random.random() < increase_prob:
+                    _, journal = operations.apply(operations.increase_cost, replica)
+                else:
+                    _, journal = operations.apply(operations.decrease_cost, replica, table)
+                new_cost = replica.cost()
+                delta = (new_cost - old_cost) / old_cost
+                if not (delta < 0 or random.random() < math.exp(-delta / t)):
+                    Tree.undo(journal)
+                if replica.cost() < Tree.costs[best_id]:
+                    best_id = replica.id
+                if budget is not None and budget.step(replica):
+                    budget.restore(tree)
+                    return
+            replicas[index] = replica.id
+        for index in range(population - 1):
+            energy_delta = (Tree.costs[replicas[index]] - Tree.costs[replicas[index + 1]]) / initial_cost
+            if random.random() < math.exp(min(energy_delta * (1 / temperatures[index] - 1 / temperatures[index + 1]), 0)):
+                replicas[index], replicas[index + 1] = replicas[index + 1], replicas[index]
+    tree.assign(Tree.from_id(best_id))
+    while operations.decrease_cost(tree, table):
+        if budget is not None and budget.step(tree):
+            break
+    if budget is not None:
+        budget.restore(tree)
+
+def _restart(heuristic, formula, seed, budget=None):
+    """ Runs `heuristic` on the tree of `formula` after seeding the random generator with `seed`, under `budget` if it is given.
+    It returns the cost and the formula of the result, together with the budget, which carries back the trace and the operations used.
+    This is the unit of work shipped to the executor by `iterate`.
+    Like `_neighbor`, it starts by emptying the tables of interned subformulas and the counts of candidates left in the worker process.
+    """
+
+    Tree.clear()
+    operations.clear_counts()
+    random.seed(seed)
+    tree = Tree.parse(formula)
+    if budget is None:
+        heuristic(tree)
+    else:
+        heuristic(tree, budget=budget)
+    return tree.cost(), tree.formula, budget
+
+def iterate(tree, heuristic, iterations=10, table=None, executor=None, budget=None):
+    """ Performs `iterations` runs of `heuristic` on `tree` and assigns to it the best result.
+    Every run is seeded with its own seed drawn from the random generator, so if `executor` (like a `ProcessPoolExecutor`) is given,
+    the runs are spread over its workers, with the same result regardless of their number.
+    Otherwise, if `table` is given, it is shared by all the runs, which mostly revisit the same states, so `heuristic` needs to accept it as a keyword argument.
+    If `budget` is given, it is split evenly among the runs, which also need to accept it as a keyword argument, and their traces are merged into it.
+    Concurrent runs share its deadline, while every sequential run gets an even share of the time left when it starts.
+    """
+    seeds = [random.getrandbits(64) for _ in range(iterations)]
+    budgets = [None] * iterations if budget is None else budget.split(iterations)
+    if executor is not None:
+        results = list(executor.map(_restart, itertools.repeat(heuristic), itertools.repeat(tree.formula), seeds, budgets))
+        _, formula, _ = min(results, key=lambda result: result[0])
+        tree.assign(Tree.parse(formula))
+        budgets = [result[2] for result in results]
+    else:
+        state = random.getstate()
+        best_cost = 1e9
+        best_tree = None
+        for index, (seed, run_budget) in enumerate(zip(seeds, budgets)):
+            random.seed(seed)
+            copy = tree.clone()
+            kwargs = dict()
+            if table is not None:
+                kwargs['table'] = table
+            if run_budget is not None:
+                run_budget.deadline = budget.share(iterations - index)
+                kwargs['budget'] = run_budget
+            heuristic(copy, **kwargs)
+            cost = copy.cost()
+            if cost < best_cost:
+                best_cost = cost
+                best_tree = copy
+        random.setstate(state)
+        tree.assign(best_tree)
+    if budget is not None:
+        budget.merge(budgets)
+        cost = budget.cost(tree)
+        if budget.best is None or cost < budget.best_cost:
+            budget.best = tree.clone()
+            budget.best_cost = cost
@@ -0,0 +1,123 @@
+import time
+import operations
+import tracemalloc
+from tree import Tree
+
+TARGETS = [
+    (Tree, '__init__'),
+    (Tree, 'from_id'),
+    (Tree, 'reset'),
+    (Tree, 'assign'),
+    (Tree, 'trim'),
+    (Tree, 'retrim'),
+    (Tree, 'clone'),
+    (operations, 'factorize'),
+    (operations, 'absorb'),
+    (operations, 'distribute'),
+    (operations, 'find_factorizable_lists'),
+    (operations, 'find_absorbable_lists'),
+    (operations, 'find_distributable_nodes'),
+    (operations, 'count_candidates'),
+    (operations, 'random_candidate')
+]
+
+GROUPS = {
+    'Resets': ['Tree.reset'],
+    'Trims': ['Tree.trim', 'Tree.retrim'],
+    'Clones': ['Tree.clone'],
+    'Mutators': ['operations.factorize', 'operations.absorb', 'operations.distribute'],
+    'Scans': [
+        'operations.find_factorizable_lists', 'operations.find_absorbable_lists', 'operations.find_distributable_nodes',
+        'operations.count_candidates', 'operations.random_candidate'
+    ]
+}
+
+originals = dict()
+counters = dict()
+depths = dict()
+
+def wrap(name, function):
+    """ Returns a wrapper of `function` which counts its calls under `name` and measures the time spent in it.
+    Recursive calls are counted, but only the outermost call is timed, so the time is never counted twice.
+    The targets of the same group share their nesting depth, so the time of a target called by another one of its group,
+    like `operations.count_candidates` by `operations.random_candidate`, is not counted twice in the total of the group either.
+    """
+
+    counter = counters[name]
+    depth = depths.setdefault(next((group for group, names in GROUPS.items() if name in names), name), [0])
+
+    def wrapper(*args, **kwargs):
+        counter[0] += 1
+        if depth[0]:
+            return function(*args, **kwargs)
+        depth[0] += 1
+        old_time = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            counter[1] += time.perf_counter() - old_time
+            depth[0] -= 1
+
+    return wrapper
+
+def enable(memory=True):
+    """ Starts counting and timing the calls to the `TARGETS` by replacing them with wrappers.
+    If `memory` is set, the peak memory is also tracked with `tracemalloc`.
+    When instrumentation is disabled, the original functions are in place, so there is no overhead at all.
+    """
+
+    if originals:
+        return
+    for owner, attribute in TARGETS:
+        name = f'{owner.__name__}.{attribute}'
+        original = vars(owner)[attribute]
+        originals[name] = owner, attribute, original
+        counters[name] = [0, 0]
+        if isinstance(original, staticmethod):
+            setattr(owner, attribute, staticmethod(wrap(name, original.__func__)))
+        else:
+            setattr(owner, attribute, wrap(name, original))
+    if memory:
+        tracemalloc.start()
+
+def disable():
+    """ Puts back the original functions and stops tracking the memory. """
+    for owner, attribute, original in originals.values():
+        setattr(owner, attribute, original)
+    originals.clear()
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+def clear():
+    """ Resets all the counters and the memory peak. """
+    for counter in counters.values():
+        counter[0] = counter[1] = 0
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+def snapshot():
+    """ Returns the current totals as a JSON-serializable dictionary:
+    the number of calls and the seconds spent in each target, the number of nodes allocated, and the peak memory in bytes.
+    """
+
+    return {
+        'calls': {name: counter[0] for name, counter in counters.items()},
+        'seconds': {name: counter[1] for name, counter in counters.items()},
+        'nodes': counters['Tree.__init__'][0] + counters['Tree.from_id'][0] if counters else 0,
+        'peak_memory': tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else 0
+    }
+
+def summarize(snapshots):
+    """ Aggregates the given snapshots into the cells shown in the results table for each of the `GROUPS`,
+    namely the average number of calls and seconds per run, followed by the average number of nodes allocated and the maximum peak memory.
+    """
+
+    count = max(len(snapshots), 1)
+    cells = []
+    for names in GROUPS.values():
+        calls = sum([snapshot['calls'][name] for snapshot in snapshots for name in names])
+        seconds = sum([snapshot['seconds'][name] for snapshot in snapshots for name in names])
+        cells += ['{:.0f} / {:.3f}s'.format(calls / count, seconds / count)]
+    cells += ['{:.0f}'.format(sum([snapshot['nodes'] for snapshot in snapshots]) / count)]
+    cells += ['{:.1f}'.format(max([snapshot['peak_memory'] for snapshot in snapshots], default=0) / 1024)]
+    return cells
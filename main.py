@@ -1,107 +1,547 @@
 import os
+import zlib
+import json
+import sys
 import time
+import socket
+import hashlib
+import argparse
+import random
 import shutil
 import inspect
+import operations
 import heuristics
+import equivalence
 import questionary
+import instrumentation
 from tree import Tree
+from cache import Cache
 from pathlib import Path
 from rich.table import Table
 from rich.console import Console
 from rich.progress import Progress
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-def run(dataset_path, heuristic, iterations=5):
-    global rows
-    with Progress() as progress:
-        filenames = [entry.name for entry in os.scandir(dataset_path) if entry.is_file() and os.path.splitext(entry.name)[1] == '.txt']
-        for filename in filenames:
-            results_path = dataset_path / 'results' / heuristic.__name__
-            results_path.mkdir(parents=True, exist_ok=True)
-            task = progress.add_task(f'Running [yellow]{heuristic.__name__}[/yellow] for [yellow]{filename[0:-4]}[/yellow]')
-
-            with open(results_path / filename, 'w') as fd:
-                total_avg_improvement = 0
-                total_max_improvement = 0
-                total_avg_runningtime = 0
-
-                formulas = [line for line in open(dataset_path / filename, 'r').read().split('\n') if line != '']
-                for formula in formulas:
-                    avg_improvement = 0
-                    max_improvement = 0, ''
-                    avg_runningtime = 0
-
-                    for _ in range(iterations):
-                        tree = Tree.parse(formula)
-                        old_cost = tree.cost()
-                        old_time = time.time()
-                        heuristic(tree)
-                        new_time = time.time()
-                        new_cost = tree.cost()
-
-                        improvement = (old_cost - new_cost) / old_cost * 100
-                        runningtime = new_time - old_time
-                        avg_improvement += improvement
-                        max_improvement = max(max_improvement, (improvement, tree.formula))
-                        avg_runningtime += runningtime
-                        progress.update(task, advance=100 / len(formulas) / iterations)
-
-                    avg_improvement /= iterations
-                    avg_runningtime /= iterations
-                    fd.write(max_improvement[1] + '\n')
-
-                    total_avg_improvement += avg_improvement
-                    total_max_improvement += max_improvement[0]
-                    total_avg_runningtime += avg_runningtime
-
-                total_avg_improvement /= len(formulas)
-                total_max_improvement /= len(formulas)
-                total_avg_runningtime /= len(formulas)
-
-                progress.update(task, advance=100)
-                rows += [(
-                    filename[0:-4],
-                    heuristic.__name__,
-                    '{:.2f}'.format(total_avg_improvement),
-                    '{:.2f}'.format(total_max_improvement),
-                    '{:.2f}'.format(total_avg_runningtime)
-                )]
-
-path = Path('inputs')
-subdirnames = [entry.name for entry in os.scandir(path) if entry.is_dir()]
-subdirname = questionary.select('Choose dataset directory', subdirnames).ask()
-path /= subdirname
-
-options = {function[0]: function[1] for function in inspect.getmembers(heuristics, inspect.isfunction) if function[0] != 'iterate'}
-checked = questionary.checkbox('Select heuristics to be run', list(options.keys())).ask()
-chosen_heuristics = [options[name] for name in checked]
-
-results_path = path / 'results'
-if results_path.exists():
-    shutil.rmtree(results_path)
-
-table = Table(title=f'Score and Time Analysis on Dataset [yellow]{subdirname}[/yellow]', header_style='bold green')
-table.add_column('Filename', justify='center')
-table.add_column('Heuristic', justify='left')
-table.add_column('Average Score (%)', justify='right')
-table.add_column('Maximum Score (%)', justify='right')
-table.add_column('Average Running Time (s)', justify='right')
-
-console = Console()
-console.print()
-
-rows = []
-for heuristic in chosen_heuristics:
-    run(path, heuristic)
-rows.sort()
-for index, row in enumerate(rows, 1):
-    new_row = list(row)
-    best_avg_improvement = max([row[2] for row in rows if row[0] == new_row[0]], key=lambda val: float(val))
-    best_max_improvement = max([row[3] for row in rows if row[0] == new_row[0]], key=lambda val: float(val))
-    if best_avg_improvement == new_row[2]: new_row[2] = f'[red]{new_row[2]}[/red]'
-    if best_max_improvement == new_row[3]: new_row[3] = f'[red]{new_row[3]}[/red]'
-    table.add_row(*new_row, end_section=index % len(chosen_heuristics) == 0)
-
-console.print()
-console.print(table)
-console.print()
-console.print(f'Finished running heuristics! 🎉')
+def run_iteration(heuristic, formula, seed, instrument=False, start=None, seconds=None):
+    """ Runs `heuristic` once on `formula`, after seeding the random generator of the current process with `seed`.
+    If `start` is given, the heuristic is warm-started from it instead, but the improvement is still measured against `formula`.
+    If `seconds` is given, the heuristic runs under a `heuristics.Budget` of that many seconds and returns the best formula found in time.
+    It returns the improvement, the running time, the resulting formula, whether it was certified to be equivalent to the initial one
+    (`None` if the exact check gave up),
+    and, if `instrument` is set, the snapshot of the instrumentation counters for the heuristic (`None` otherwise),
+    to which the `trace` of the budget is added when the run is limited in time.
+    This is the unit of work shipped to the worker processes by `run`.
+    Since the worker processes live as long as `run`, it starts by emptying the tables of interned subformulas left by the previous runs,
+    which invalidates all the trees of the current process.
+    """
+
+    Tree.clear()
+    operations.clear_counts()
+    random.seed(seed)
+    initial_tree = Tree.parse(formula)
+    tree = initial_tree.clone() if start is None else Tree.parse(start)
+    old_cost = initial_tree.cost()
+    if instrument:
+        instrumentation.enable()
+        instrumentation.clear()
+    old_time = time.time()
+    budget = None if seconds is None else heuristics.Budget(seconds)
+    if budget is None:
+        heuristic(tree)
+    else:
+        heuristic(tree, budget=budget)
+    new_time = time.time()
+    profile = instrumentation.snapshot() if instrument else None
+    if profile is not None and budget is not None:
+        profile['trace'] = budget.trace
+    new_cost = tree.cost()
+    certified = equivalence.equivalent(initial_tree, tree)
+    return (old_cost - new_cost) / old_cost * 100, new_time - old_time, tree.formula, certified, profile
+
+def canonical(formula):
+    """ Returns the canonical form of `formula` and its cost, without keeping anything in the tables of interned subformulas,
+    so the main process of `run` does not accumulate the whole dataset and all the results; this invalidates all the trees of the current process.
+    """
+
+    tree = Tree.parse(formula)
+    result = tree.formula, tree.cost()
+    Tree.clear()
+    operations.clear_counts()
+    return result
+
+def heuristic_key(heuristic, seconds=None):
+    """ Returns the key of the runs of `heuristic` in the cache, made of its name, a digest of the default values of its parameters,
+    and the time limit per run, if any, so editing the defaults of a heuristic does not return the results of the old ones.
+    Functions and classes given as defaults are named by their qualified names, so the key is the same in every process.
+    """
+
+    defaults = [
+        (name, getattr(parameter.default, '__qualname__', parameter.default))
+        for name, parameter in inspect.signature(heuristic).parameters.items() if parameter.default is not inspect.Parameter.empty
+    ]
+    key = f'{heuristic.__name__}/{hashlib.sha256(repr(defaults).encode()).hexdigest()[0:16]}'
+    return key if seconds is None else f'{key}/{seconds}s'
+
+CERTIFICATES = {True: ('1', 'yes'), False: ('0', '[red]no[/red]'), None: ('?', '[yellow]unknown[/yellow]')}
+
+def combine_certificates(certificates):
+    """ Returns `False` if any of the given certificates is `False`, `None` if any of them is unknown, and `True` otherwise. """
+    if any([certificate is False for certificate in certificates]):
+        return False
+    if any([certificate is None for certificate in certificates]):
+        return None
+    return True
+
+def dataset_filenames(dataset_path):
+    """ Returns the names of the formula files of the dataset at `dataset_path`. """
+    return [entry.name for entry in os.scandir(dataset_path) if entry.is_file() and os.path.splitext(entry.name)[1] == '.txt']
+
+def read_formulas(path, skip=0):
+    """ Lazily yields the formulas in the file at `path`, one line at a time, skipping the first `skip` of them. """
+    with open(path, 'r') as fd:
+        for line in fd:
+            line = line.strip()
+            if line == '':
+                continue
+            if skip > 0:
+                skip -= 1
+                continue
+            yield line
+
+def read_lines(path):
+    """ Returns the complete lines of the file at `path`, leaving out a last line torn by a crash, or an empty list if there is no such file. """
+    if not path.exists():
+        return []
+    with open(path, 'r') as fd:
+        return [line for line in fd if line.endswith('\n')]
+
+def truncate_lines(path, count):
+    """ Keeps only the first `count` lines of the file at `path`, which may end with a partially written one. """
+    with open(path, 'rb+') as fd:
+        size = 0
+        for _ in range(count):
+            size += len(fd.readline())
+        fd.truncate(size)
+
+def write_atomically(path, lines):
+    """ Replaces the contents of the file at `path` with the given lines, through a temporary file renamed over it,
+    so a crash leaves either the old contents or the new ones, but never a mix of them.
+    The temporary file is named after the node and the process, so workers replacing the same file at once do not write into each other's.
+    """
+
+    temporary_path = path.with_name(f'{path.name}.{socket.gethostname()}.{os.getpid()}.tmp')
+    with open(temporary_path, 'w') as fd:
+        fd.writelines(lines)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.replace(temporary_path, path)
+
+def append_durably(fd, lines):
+    """ Appends the given lines to the file opened as `fd` and waits until they reach the disk. """
+    fd.writelines(lines)
+    fd.flush()
+    os.fsync(fd.fileno())
+
+def shard_indices(heuristic_name, formula_count, shard=None):
+    """ Returns the indices of the formulas of a file with `formula_count` formulas that are run by the given heuristic in `shard`.
+    A shard is a pair of its index and the number of shards, and `None` stands for the whole file.
+    The formulas are dealt to the shards round-robin, starting from a shard given by a checksum of the name of the heuristic,
+    so the shards are balanced, the same on every node, and do not all get the leftover formulas of every heuristic.
+    """
+
+    if shard is None:
+        return list(range(formula_count))
+    shard_index, shard_count = shard
+    offset = zlib.crc32(heuristic_name.encode())
+    return [index for index in range(formula_count) if (index + offset) % shard_count == shard_index]
+
+def results_directory(dataset_path, shard=None):
+    """ Returns the directory of the results of `shard` of the dataset, or its `results` directory if `shard` is `None`. """
+    return dataset_path / 'results' if shard is None else dataset_path / 'shards' / '{}-of-{}'.format(*shard)
+
+def merge_shards(dataset_path):
+    """ Merges the results of the shards of the dataset found in `{dataset}/shards` into its `results` directory, in the order of the files.
+    For every heuristic and file, only the longest prefix of formulas already written by their shards is merged,
+    and only if it is longer than the results already there, so merging can be repeated while the shards are still running,
+    and the remaining formulas can then be run locally by `run`.
+    """
+
+    shards_path = dataset_path / 'shards'
+    shards = [tuple(map(int, entry.name.split('-of-'))) for entry in os.scandir(shards_path) if entry.is_dir() and '-of-' in entry.name]
+    for shard_count in sorted({shard_count for _, shard_count in shards}):
+        count_shards = [(shard_index, shard_count) for shard_index in range(shard_count)]
+        names = sorted({
+            entry.name
+            for shard in count_shards if results_directory(dataset_path, shard).exists()
+            for entry in os.scandir(results_directory(dataset_path, shard)) if entry.is_dir()
+        })
+        for name in names:
+            for filename in dataset_filenames(dataset_path):
+                formula_count = sum([1 for _ in read_formulas(dataset_path / filename)])
+                lines = dict()
+                for shard in count_shards:
+                    path = results_directory(dataset_path, shard) / name
+                    indices = shard_indices(name, formula_count, shard)
+                    formulas = read_lines(path / filename)
+                    stats = read_lines(path / (filename[0:-4] + '.stats'))
+                    profiles = dict()
+                    for line in read_lines(path / (filename[0:-4] + '.profile.jsonl')):
+                        profile = json.loads(line)
+                        profile['formula'] = indices[profile['formula']]
+                        profiles.setdefault(profile['formula'], [])
+                        profiles[profile['formula']] += [json.dumps(profile) + '\n']
+                    for position in range(min(len(formulas), len(stats))):
+                        lines[indices[position]] = formulas[position], stats[position], profiles.get(indices[position], [])
+                merged = 0
+                while merged in lines:
+                    merged += 1
+
+                path = results_directory(dataset_path) / name
+                path.mkdir(parents=True, exist_ok=True)
+                if merged <= min(len(read_lines(path / filename)), len(read_lines(path / (filename[0:-4] + '.stats')))):
+                    continue
+                profiles = [line for index in range(merged) for line in lines[index][2]]
+                if profiles:
+                    write_atomically(path / (filename[0:-4] + '.profile.jsonl'), profiles)
+                write_atomically(path / filename, [lines[index][0] for index in range(merged)])
+                write_atomically(path / (filename[0:-4] + '.stats'), [lines[index][1] for index in range(merged)])
+
+QUEUE_STATES = ['.todo', '.claimed', '.done']
+
+def enqueue_shards(dataset_path, shard_count):
+    """ Adds the `shard_count` shards of the dataset to its file-based work queue in `{dataset}/shards/queue`, unless they were added before.
+    Every shard is a file named `{shard_index}-of-{shard_count}` followed by its state, which only moves forward through `QUEUE_STATES`.
+    The queue only relies on renaming files being atomic, so it works for the nodes of a cluster sharing the dataset directory,
+    and several workers started on a single machine emulate such a cluster.
+    """
+
+    queue_path = dataset_path / 'shards' / 'queue'
+    queue_path.mkdir(parents=True, exist_ok=True)
+    for shard_index in range(shard_count):
+        name = f'{shard_index}-of-{shard_count}'
+        if not any([(queue_path / (name + state)).exists() for state in QUEUE_STATES]):
+            (queue_path / (name + '.todo')).touch()
+
+def claim_shard(dataset_path, shard_count):
+    """ Claims the first shard left to do in the work queue of the dataset, recording the node and process which claimed it, and returns it.
+    The shard is claimed by renaming it, so no two workers can claim the same one. It returns `None` if no shard is left to do.
+    A shard claimed by a worker that died can be put back in the queue by renaming it back, and it then resumes from its journal.
+    """
+
+    queue_path = dataset_path / 'shards' / 'queue'
+    for path in sorted(queue_path.glob(f'*-of-{shard_count}.todo')):
+        claimed_path = path.with_suffix('.claimed')
+        try:
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            continue
+        with open(claimed_path, 'w') as fd:
+            fd.write(f'{socket.gethostname()} {os.getpid()}\n')
+        return tuple(map(int, path.stem.split('-of-')))
+    return None
+
+def work(dataset_path, chosen_heuristics, shard_count, **kwargs):
+    """ Runs the shards of the dataset claimed from its work queue one by one with `run`, given `kwargs`, until no shard is left to do.
+    It returns whether this worker is the one to merge them by `merge_shards`, namely whether all the shards are done
+    and this worker created the `merge-of-{shard_count}` file in the work queue first, so no two workers finishing at once both merge.
+    """
+
+    enqueue_shards(dataset_path, shard_count)
+    queue_path = dataset_path / 'shards' / 'queue'
+    while True:
+        shard = claim_shard(dataset_path, shard_count)
+        if shard is None:
+            break
+        run(dataset_path, chosen_heuristics, shard=shard, **kwargs)
+        name = '{}-of-{}'.format(*shard)
+        os.replace(queue_path / (name + '.claimed'), queue_path / (name + '.done'))
+    if not all([(queue_path / f'{shard_index}-of-{shard_count}.done').exists() for shard_index in range(shard_count)]):
+        return False
+    try:
+        fd = os.open(queue_path / f'merge-of-{shard_count}', os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w') as fd:
+        fd.write(f'{socket.gethostname()} {os.getpid()}\n')
+    return True
+
+class Job:
+    """ Used for streaming the results of running one heuristic on one dataset file.
+    It stores the following data:
+    1. `heuristic`, `filename` and `shard` which identify the job
+    2. `task` the progress bar of the job
+    3. `indices` the indices in the file of the formulas of the shard, and `formula_count` their number
+    4. `iterations` the number of runs for each formula
+    5. `written` the number of formulas whose results were already written, in the order of the file
+    6. `pending` the seeds and results of the runs for the formulas which were not written yet, indexed by formula
+    7. `done` the pairs of formula index and seed of the runs in `pending`, which need not be run again
+    8. `totals` the sums of the average improvements, maximum improvements and average running times over the written formulas
+    9. `certified` whether all the written formulas were certified, as combined by `combine_certificates`
+    10. `profiles` the instrumentation snapshots of the runs on the written formulas, or `None` if the job is not instrumented
+    The best formulas are appended to `{dataset}/results/{heuristic}/{filename}` and their stats to the `.stats` file next to it,
+    one line per formula of the shard, so a job can be resumed by skipping the formulas already present in both files.
+    The results of a shard go to the directory given by `results_directory` instead, and the formulas are numbered by their position in the shard.
+    Every finished run is also journaled as a JSON line in the `.runs.jsonl` file next to them before anything else is done with it,
+    so a job interrupted in the middle of the iterations of a formula resumes from the runs it had already finished.
+    When instrumented, the snapshot of every run is also dumped as a JSON line in the `.profile.jsonl` file next to them.
+    All the files are only appended to while running and synced after every line, and a line torn by a crash is dropped when resuming.
+    """
+
+    def __init__(self, dataset_path, heuristic, filename, progress, instrument=False, iterations=5, shard=None):
+        """ Constructs the job, loading the stats of the formulas completed by a previous run and its journaled runs, if any. """
+        self.heuristic = heuristic
+        self.filename = filename
+        self.shard = shard
+        self.indices = shard_indices(heuristic.__name__, sum([1 for _ in read_formulas(dataset_path / filename)]), shard)
+        self.formula_count = len(self.indices)
+        self.iterations = iterations
+        self.pending = dict()
+        self.done = set()
+        self.totals = [0, 0, 0]
+        self.certified = True
+        self.profiles = [] if instrument else None
+
+        results_path = results_directory(dataset_path, shard) / heuristic.__name__
+        results_path.mkdir(parents=True, exist_ok=True)
+        formulas_path = results_path / filename
+        stats_path = results_path / (filename[0:-4] + '.stats')
+        formulas_path.touch()
+        stats_path.touch()
+        self.written = min(sum([1 for line in open(formulas_path, 'r') if line.endswith('\n')]), sum([1 for line in open(stats_path, 'r') if line.endswith('\n')]))
+        truncate_lines(formulas_path, self.written)
+        truncate_lines(stats_path, self.written)
+        with open(stats_path, 'r') as fd:
+            for line in fd:
+                *values, certified = line.split()
+                for index, value in enumerate(values):
+                    self.totals[index] += float(value)
+                self.certified = combine_certificates([self.certified, next(certificate for certificate, (code, _) in CERTIFICATES.items() if code == certified)])
+
+        self.formulas_fd = open(formulas_path, 'a')
+        self.stats_fd = open(stats_path, 'a')
+        self.profile_fd = None
+        if instrument:
+            profile_path = results_path / (filename[0:-4] + '.profile.jsonl')
+            profile_path.touch()
+            with open(profile_path, 'r') as fd:
+                lines = [line for line in fd if line.endswith('\n') and json.loads(line)['formula'] < self.written]
+            write_atomically(profile_path, lines)
+            self.profiles = [json.loads(line) for line in lines]
+            self.profile_fd = open(profile_path, 'a')
+
+        self.runs_path = results_path / (filename[0:-4] + '.runs.jsonl')
+        self.runs_path.touch()
+        with open(self.runs_path, 'r') as fd:
+            lines = [line for line in fd if line.endswith('\n') and json.loads(line)['formula'] >= self.written]
+        write_atomically(self.runs_path, lines)
+        for line in lines:
+            record = json.loads(line)
+            self.store_result(record['formula'], record['seed'], tuple(record['result']))
+        self.runs_fd = open(self.runs_path, 'a')
+        self.task = progress.add_task(
+            f'Running [yellow]{heuristic.__name__}[/yellow] for [yellow]{filename[0:-4]}[/yellow]',
+            completed=100 * (self.written + len(self.done) / iterations) / max(self.formula_count, 1)
+        )
+        self.write_results()
+
+    def store_result(self, index, seed, result):
+        """ Stores the result of the run seeded by `seed` on the formula with the given index, unless it is already stored. """
+        if (index, seed) not in self.done:
+            self.done |= {(index, seed)}
+            self.pending.setdefault(index, [])
+            self.pending[index] += [(seed, result)]
+
+    def add_result(self, index, seed, result):
+        """ Journals and stores the result of the run seeded by `seed` and writes the stats of every formula that can now be written in order. """
+        append_durably(self.runs_fd, [json.dumps({'formula': index, 'seed': seed, 'result': result}) + '\n'])
+        self.store_result(index, seed, result)
+        self.write_results()
+
+    def write_results(self):
+        """ Writes the stats of every formula whose runs are all done and which comes next in the order of the file. """
+        iterations = self.iterations
+        while len(self.pending.get(self.written, [])) == iterations:
+            formula_results = [result for _, result in self.pending[self.written]]
+            avg_improvement = sum([improvement for improvement, _, _, _, _ in formula_results]) / iterations
+            max_improvement = max([(improvement, formula) for improvement, _, formula, _, _ in formula_results])
+            avg_runningtime = sum([runningtime for _, runningtime, _, _, _ in formula_results]) / iterations
+            certified = combine_certificates([formula_certified for _, _, _, formula_certified, _ in formula_results])
+
+            if self.profile_fd is not None:
+                profiles = [{'formula': self.written, 'seed': seed, **profile} for seed, (_, _, _, _, profile) in self.pending[self.written]]
+                append_durably(self.profile_fd, [json.dumps(profile) + '\n' for profile in profiles])
+                self.profiles += profiles
+            append_durably(self.formulas_fd, [max_improvement[1] + '\n'])
+            append_durably(self.stats_fd, [f'{avg_improvement} {max_improvement[0]} {avg_runningtime} {CERTIFICATES[certified][0]}\n'])
+            for seed, _ in self.pending.pop(self.written):
+                self.done -= {(self.written, seed)}
+            for index, value in enumerate([avg_improvement, max_improvement[0], avg_runningtime]):
+                self.totals[index] += value
+            self.certified = combine_certificates([self.certified, certified])
+            self.written += 1
+
+    def row(self):
+        """ Closes the result files, empties the journal of runs if every formula was written, and returns the row of the job in the stats table. """
+        self.formulas_fd.close()
+        self.stats_fd.close()
+        self.runs_fd.close()
+        if self.written == self.formula_count:
+            write_atomically(self.runs_path, [])
+        if self.profile_fd is not None:
+            self.profile_fd.close()
+        total_avg_improvement, total_max_improvement, total_avg_runningtime = [total / max(self.formula_count, 1) for total in self.totals]
+        return (
+            self.filename[0:-4],
+            self.heuristic.__name__,
+            '{:.2f}'.format(total_avg_improvement),
+            '{:.2f}'.format(total_max_improvement),
+            '{:.2f}'.format(total_avg_runningtime),
+            CERTIFICATES[self.certified][1],
+            *([] if self.profiles is None else instrumentation.summarize(self.profiles))
+        )
+
+def run(dataset_path, chosen_heuristics, iterations=5, workers=os.cpu_count(), seed=618, instrument=False, cache=None, warm_start=False, seconds=None, shard=None):
+    """ Runs every heuristic `iterations` times on every formula of the dataset, fanning out the runs to a pool of `workers` processes.
+    Each run gets its own seed derived from `seed`, the heuristic, the canonical formula, and the iteration,
+    so the results depend neither on the order in which the workers pick up the runs, nor on where the formula appears in the dataset.
+    The formulas are read lazily and only a bounded number of runs is in flight at any time.
+    The best formula of each entry is written to `{dataset}/results/{heuristic}/{filename}` as soon as all its runs are done,
+    and the entries already present there from an interrupted run are skipped, as well as the runs it had already journaled.
+    Once every entry is written, the rows are rebuilt from the result files alone, without running anything. It returns the rows of the stats table.
+    If `instrument` is set, the hot paths are counted and timed in every run, and the totals are added to the rows.
+    If `cache` is given, the runs already stored in it are not run again, and the new ones are stored in it.
+    If `warm_start` is also set, the heuristics start from the best formula stored in `cache` for each entry, when there is one.
+    If `seconds` is given, every run is limited to that many seconds, and its runs are cached separately from the unlimited ones.
+    If `shard` is given, only the formulas of that shard are run, as given by `shard_indices`, and the rows are those of the shard.
+    Since the seeds do not depend on the position of the formulas, the merged results of the shards are the ones of an unsharded run.
+    """
+
+    with Progress() as progress, ProcessPoolExecutor(workers) as executor:
+        jobs = [Job(dataset_path, heuristic, filename, progress, instrument, iterations, shard) for heuristic in chosen_heuristics for filename in dataset_filenames(dataset_path)]
+
+        def generate_runs():
+            for job in jobs:
+                if job.written == job.formula_count:
+                    continue
+                positions = {index: position for position, index in enumerate(job.indices)}
+                skip = job.indices[job.written]
+                for index, formula in enumerate(read_formulas(dataset_path / job.filename, skip), skip):
+                    if index not in positions:
+                        continue
+                    index = positions[index]
+                    formula, _ = canonical(formula)
+                    digest = hashlib.sha256(formula.encode()).hexdigest()[0:16]
+                    start = cache.best(formula) if cache is not None and warm_start else None
+                    for iteration in range(iterations):
+                        run_seed = f'{seed}/{job.heuristic.__name__}/{digest}/{iteration}'
+                        if (index, run_seed) not in job.done:
+                            yield job, index, formula, start, run_seed
+
+        def finish_run(job, index, run_seed, result):
+            job.add_result(index, run_seed, result)
+            progress.update(job.task, advance=100 / job.formula_count / iterations)
+
+        def submit_runs(count):
+            while count > 0:
+                entry = next(runs, None)
+                if entry is None:
+                    return
+                job, index, formula, start, run_seed = entry
+                result = None if cache is None else cache.get(formula, heuristic_key(job.heuristic, seconds), run_seed, start)
+                if result is not None and (not instrument or result[4] is not None):
+                    finish_run(job, index, run_seed, result)
+                else:
+                    futures[executor.submit(run_iteration, job.heuristic, formula, run_seed, instrument, start, seconds)] = job, index, formula, start, run_seed
+                    count -= 1
+
+        runs = generate_runs()
+        futures = dict()
+        submit_runs(4 * workers)
+        while futures:
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                job, index, formula, start, run_seed = futures.pop(future)
+                result = future.result()
+                if cache is not None:
+                    cache.put(formula, heuristic_key(job.heuristic, seconds), run_seed, start, result, canonical(result[2])[1])
+                finish_run(job, index, run_seed, result)
+            submit_runs(len(finished))
+        return [job.row() for job in jobs]
+
+def make_table(dataset_name, rows, heuristic_count, instrument=False):
+    """ Returns the stats table of the given rows, as returned by `run` for `heuristic_count` heuristics, highlighting the best scores of every file. """
+    table = Table(title=f'Score and Time Analysis on Dataset [yellow]{dataset_name}[/yellow]', header_style='bold green')
+    table.add_column('Filename', justify='center')
+    table.add_column('Heuristic', justify='left')
+    table.add_column('Average Score (%)', justify='right')
+    table.add_column('Maximum Score (%)', justify='right')
+    table.add_column('Average Running Time (s)', justify='right')
+    table.add_column('Certified', justify='center')
+    if instrument:
+        for group in instrumentation.GROUPS:
+            table.add_column(f'{group} (calls / time)', justify='right')
+        table.add_column('Nodes Allocated', justify='right')
+        table.add_column('Peak Memory (KiB)', justify='right')
+
+    rows = sorted(rows)
+    for index, row in enumerate(rows, 1):
+        new_row = list(row)
+        best_avg_improvement = max([row[2] for row in rows if row[0] == new_row[0]], key=lambda val: float(val))
+        best_max_improvement = max([row[3] for row in rows if row[0] == new_row[0]], key=lambda val: float(val))
+        if best_avg_improvement == new_row[2]: new_row[2] = f'[red]{new_row[2]}[/red]'
+        if best_max_improvement == new_row[3]: new_row[3] = f'[red]{new_row[3]}[/red]'
+        table.add_row(*new_row, end_section=index % heuristic_count == 0)
+    return table
+
+if __name__ == '__main__':
+    options = {function[0]: function[1] for function in inspect.getmembers(heuristics, inspect.isfunction) if function[0] != 'iterate' and not function[0].startswith('_')}
+    console = Console()
+
+    if len(sys.argv) > 1:
+        parser = argparse.ArgumentParser(description='Runs the shards of a dataset from its work queue without asking anything, then merges them once they are all done.')
+        parser.add_argument('dataset', help='name of the dataset directory in inputs')
+        parser.add_argument('shard_count', type=int, help='number of shards the dataset is split into')
+        parser.add_argument('heuristics', nargs='+', choices=list(options.keys()), help='heuristics to be run')
+        parser.add_argument('--seconds', type=float, help='time limit per run in seconds')
+        parser.add_argument('--cache', help='path of a cache on storage local to the node (SQLite does not work on network filesystems), none by default')
+        arguments = parser.parse_args()
+        cache = None if arguments.cache is None else Cache(arguments.cache)
+        path = Path('inputs') / arguments.dataset
+        chosen_heuristics = [options[name] for name in arguments.heuristics]
+        if work(path, chosen_heuristics, arguments.shard_count, cache=cache, seconds=arguments.seconds):
+            merge_shards(path)
+            rows = run(path, chosen_heuristics, cache=cache, seconds=arguments.seconds)
+            console.print(make_table(arguments.dataset, rows, len(chosen_heuristics)))
+        else:
+            console.print('No shard left to claim, another worker will merge the shards once they are done.')
+        if cache is not None:
+            cache.close()
+        sys.exit()
+
+    cache = Cache('cache.sqlite')
+
+    path = Path('inputs')
+    subdirnames = [entry.name for entry in os.scandir(path) if entry.is_dir()]
+    subdirname = questionary.select('Choose dataset directory', subdirnames).ask()
+    path /= subdirname
+
+    checked = questionary.checkbox('Select heuristics to be run', list(options.keys())).ask()
+    chosen_heuristics = [options[name] for name in checked]
+    instrument = questionary.confirm('Collect instrumentation counters?', default=False).ask()
+    seconds = questionary.text('Time limit per run in seconds (leave empty for none)', default='').ask()
+    seconds = float(seconds) if seconds else None
+    warm_start = questionary.confirm('Warm-start the heuristics from the best formulas found so far?', default=False).ask()
+
+    results_path = path / 'results'
+    if results_path.exists() and not questionary.confirm('Resume the previous run on this dataset?', default=True).ask():
+        shutil.rmtree(results_path)
+    if (path / 'shards').exists() and questionary.confirm('Merge the results of the shards run so far?', default=True).ask():
+        merge_shards(path)
+
+    console.print()
+    rows = run(path, chosen_heuristics, instrument=instrument, cache=cache, warm_start=warm_start, seconds=seconds)
+    cache.close()
+    console.print()
+    console.print(make_table(subdirname, rows, len(chosen_heuristics), instrument))
+    console.print()
+    console.print(f'Finished running heuristics! 🎉')
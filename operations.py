@@ -1,22 +1,140 @@
 import random
 from tree import Tree
+from collections import OrderedDict
 
-def find_factorizable_lists(tree):
-    """ Finds every subformula of the form `(x*φ1)+(x*φ2)+...+(x*φn)` or `(x+φ1)*(x+φ2)*...*(x+φn)`,
-    creates a list containing the `x` nodes, and adds it to the returned lists.
+FACTORIZABLE = 0
+ABSORBABLE = 1
+DISTRIBUTABLE = 2
+
+class TranspositionTable:
+    """ Used for memoizing data about states or subformulas by their id, which identifies their canonical form, in bounded memory.
+    It behaves like a dictionary, except that only the `capacity` most recently used entries are kept.
+    """
+
+    def __init__(self, capacity=1 << 20):
+        """ Constructs an empty table holding at most `capacity` entries. """
+        self.capacity = capacity
+        self.entries = OrderedDict()
+
+    def __contains__(self, id):
+        return id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, id):
+        """ Returns the entry of `id` and marks it as the most recently used one. """
+        self.entries.move_to_end(id)
+        return self.entries[id]
+
+    def __setitem__(self, id, value):
+        """ Stores the entry of `id` as the most recently used one, evicting the least recently used entry if the table is full. """
+        self.entries[id] = value
+        self.entries.move_to_end(id)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+local_counts = TranspositionTable()
+subtree_counts = TranspositionTable()
+
+def clear_counts():
+    """ Empties the memoized candidate counts, which are keyed by ids, so they need to go whenever `Tree.clear` is called. """
+    local_counts.entries.clear()
+    subtree_counts.entries.clear()
+
+def count_local_candidates(id):
+    """ Returns the number of factorizable lists, absorbable lists, and distributable nodes rooted directly at the node identified by `id`.
+    The counts only depend on the interned structure, so they are computed from the id tables without materializing any node and memoized.
     """
 
+    if id in local_counts:
+        return local_counts[id]
+    gate, child_ids = Tree.keys[id]
+    counts = 0, 0, 0
+    if gate != '?':
+        grandchildren = dict()
+        for child_id in child_ids:
+            child_gate, grandchild_ids = Tree.keys[child_id]
+            if child_gate != '?':
+                for grandchild_id in grandchild_ids:
+                    grandchildren[grandchild_id] = grandchildren.get(grandchild_id, 0) + 1
+        counts = (
+            sum([1 for count in grandchildren.values() if count > 1]),
+            sum([1 for child_id in set(child_ids) if child_id in grandchildren]),
+            sum([1 for child_id in child_ids if Tree.keys[child_id][0] != '?'])
+        )
+    local_counts[id] = counts
+    return counts
+
+def count_candidates(id):
+    """ Returns the number of factorizable lists, absorbable lists, and distributable nodes in the whole subtree identified by `id`.
+    The counts are memoized by id, so after an operation only the ids created along the edited paths need to be counted again.
+    Since the memo is a transposition table, the counts of the states revisited by a heuristic are reused, while stale ones are eventually evicted.
+    The counts of the known subformulas are copied before counting the new ones, since storing those may evict them.
+    """
+
+    if id in subtree_counts:
+        return subtree_counts[id]
+    new_counts = dict()
+
+    def known(id):
+        if id in subtree_counts:
+            new_counts[id] = subtree_counts[id]
+        return id in new_counts
+
+    for new_id in Tree.postorder([id], known):
+        counts = list(count_local_candidates(new_id))
+        if Tree.keys[new_id][0] != '?':
+            for child_id in Tree.keys[new_id][1]:
+                for kind, count in enumerate(new_counts[child_id]):
+                    counts[kind] += count
+        new_counts[new_id] = subtree_counts[new_id] = tuple(counts)
+    return new_counts[id]
+
+def random_candidate(tree, kind, index=None):
+    """ Returns a uniformly random candidate of the given kind (one of `FACTORIZABLE`, `ABSORBABLE` and `DISTRIBUTABLE`) in `tree`,
+    or the candidate numbered `index` if it is given.
+    The candidates are numbered in a canonical order, visiting children and local candidates by digest,
+    so a number always denotes the same move in a given state, in every process.
+    Instead of scanning the whole tree, it descends from the root guided by the memoized counts, so only one path gets materialized.
+    """
+
+    local_candidates = [factorizable_lists, absorbable_lists, distributable_nodes][kind]
+    if index is None:
+        index = random.randrange(count_candidates(tree.id)[kind])
+    node = tree
+    while True:
+        local_count = count_local_candidates(node.id)[kind]
+        if index < local_count:
+            return local_candidates(node)[index]
+        index -= local_count
+        for child in sorted(node.children, key=lambda child: Tree.digests[child.id]):
+            count = count_candidates(child.id)[kind]
+            if index < count:
+                node = child
+                break
+            index -= count
+
+def factorizable_lists(tree):
+    """ Returns the factorizable lists rooted directly at `tree`, ordered by the digest of their common subformula. """
     subformulas = dict()
     for child in tree.children:
         for grandchild in child.children:
-            subformulas.setdefault(grandchild.formula, [])
-            subformulas[grandchild.formula] += [grandchild]
-    lists = [nodes for nodes in subformulas.values() if len(nodes) > 1]
-    return lists + sum([find_factorizable_lists(child) for child in tree.children], [])
+            subformulas.setdefault(grandchild.id, [])
+            subformulas[grandchild.id] += [grandchild]
+    return [nodes for _, nodes in sorted(subformulas.items(), key=lambda item: Tree.digests[item[0]]) if len(nodes) > 1]
+
+def find_factorizable_lists(tree):
+    """ Finds every subformula of the form `(x*φ1)+(x*φ2)+...+(x*φn)` or `(x+φ1)*(x+φ2)*...*(x+φn)`,
+    creates a list containing the `x` nodes, and adds it to the returned lists.
+    """
+
+    return [nodes for node in tree.preorder() for nodes in factorizable_lists(node)]
 
 def factorize(nodes):
     """ Receives the `x` nodes in a subformula like `(x*φ1)+(x*φ2)+...+(x*φn)` or `(x+φ1)*(x+φ2)*...*(x+φn)`
     and replaces that subformula by `(x*(φ1+φ2+...+φn))` or `(x+(φ1*φ2*...*φn))`.
+    It returns the nodes it changed, from the bottom to the top, which are the only ones `Tree.retrim` needs to simplify with their ancestors.
     """
 
     parents = [node.parent for node in nodes]
@@ -25,83 +143,151 @@ def factorize(nodes):
     upper_operator = grandparent.gate
     for node, parent in zip(nodes, parents):
         children_parent = list(set(parent.children) - {node})
-        parent.reset(lower_operator, children_parent)
+        parent.reset(lower_operator, children_parent, False)
     lower_node = Tree(upper_operator, parents)
     upper_node = Tree(lower_operator, [nodes[0], lower_node])
     children_grandparent = list(set(grandparent.children) - set(parents))
     grandparent.reset(upper_operator, [upper_node] + children_grandparent)
+    return parents + [lower_node, upper_node, grandparent]
+
+def absorbable_lists(tree):
+    """ Returns the absorbable lists rooted directly at `tree`, ordered by the digest of the absorbing child. """
+    subformulas = {child.id: [] for child in tree.children}
+    for child in tree.children:
+        for grandchild in child.children:
+            if grandchild.id in subformulas:
+                subformulas[grandchild.id] += [child]
+    return [nodes for _, nodes in sorted(subformulas.items(), key=lambda item: Tree.digests[item[0]]) if nodes]
 
 def find_absorbable_lists(tree):
     """ Finds every subformula of the form `x+(x*φ1)+(x*φ2)+...+(x*φn)` or `x*(x+φ1)*(x+φ2)*...*(x+φn)`,
     creates a list containing the `(x*φi)` or `(x+φi)` nodes, and adds it to the returned lists.
     """
 
-    subformulas = {child.formula: [] for child in tree.children}
-    for child in tree.children:
-        for grandchild in child.children:
-            if grandchild.formula in subformulas:
-                subformulas[grandchild.formula] += [child]
-    lists = [nodes for nodes in subformulas.values() if nodes]
-    return lists + sum([find_absorbable_lists(child) for child in tree.children], [])
+    return [nodes for node in tree.preorder() for nodes in absorbable_lists(node)]
 
 def absorb(nodes):
     """ Receives the `(x*φi)` or `(x+φi)` nodes in a subformula like `x+(x*φ1)+(x*φ2)+...+(x*φn)` or `x*(x+φ1)*(x+φ2)*...*(x+φn)`
     and replaces that subformula by `x`.
+    It returns the nodes it changed, which are the only ones `Tree.retrim` needs to simplify with their ancestors.
     """
 
     parent = nodes[0].parent
     children_parent = list(set(parent.children) - set(nodes))
     parent.reset(parent.gate, children_parent)
+    return [parent]
+
+def distributable_nodes(tree):
+    """ Returns the children of `tree` having children of their own, ordered by digest. """
+    return sorted([child for child in tree.children if child.gate != '?'], key=lambda child: Tree.digests[child.id])
 
 def find_distributable_nodes(tree):
     """ Returns a list of all the nodes in `tree` having both a parent and children. """
-    nodes = [child for child in tree.children if child.children]
-    return nodes + sum([find_distributable_nodes(child) for child in tree.children], [])
+    return [child for node in tree.preorder() for child in distributable_nodes(node)]
 
 def distribute(node1, node2):
     """ For a subformula of the form `x+(y1*y2*...*yn)` or `x*(y1+y2+...+yn)`,
     it receives the `x` and `(y1*y2*...*yn)` or `(y1+y2+...+yn)` nodes as `node1` and `node2` respectively,
     and replaces that subformula by `((x+y1)*(x+y2)*...*(x+yn))` or `((x*y1)+(x*y2)+...+(x*yn))`.
+    It returns the nodes it changed, from the bottom to the top, which are the only ones `Tree.retrim` needs to simplify with their ancestors.
     """
 
     parent = node1.parent
     for child in node2.children:
         if child.children:
             children_child = [node1.clone()] + child.children
-            child.reset(parent.gate, children_child)
+            child.reset(parent.gate, children_child, False)
         else:
-            child.reset(parent.gate, [node1.clone(), child.clone()])
+            child.reset(parent.gate, [node1.clone(), child.clone()], False)
+    node2.reset(node2.gate, node2.children, False)
     children_parent = list(set(parent.children) - {node1})
     parent.reset(parent.gate, children_parent)
+    return node2.children + [node2, parent]
+
+def root_delta(node, new_id):
+    """ Returns the change in the cost of the whole (trimmed) tree if the subtree of `node` was replaced by the one identified by `new_id`.
+    The trimmed ids of the ancestors are rebuilt on the way up, so every effect of the final trimming is taken into account.
+    """
+
+    while node.parent is not None:
+        parent = node.parent
+        new_id = Tree.trimmed_id(parent.gate, [new_id] + [child.id for child in parent.children if child is not node])
+        node = parent
+    return Tree.costs[new_id] - node.cost()
+
+def factorization_delta(nodes):
+    """ Returns the exact change in cost that `factorize(nodes)` followed by trimming would produce, without applying it. """
+    parents = [node.parent for node in nodes]
+    grandparent = parents[0].parent
+    lower_operator = parents[0].gate
+    upper_operator = grandparent.gate
+    parent_ids = [Tree.trimmed_id(lower_operator, [child.id for child in parent.children if child is not node]) for node, parent in zip(nodes, parents)]
+    lower_id = Tree.trimmed_id(upper_operator, parent_ids)
+    upper_id = Tree.trimmed_id(lower_operator, [nodes[0].id, lower_id])
+    children_ids = [child.id for child in grandparent.children if child not in parents]
+    return root_delta(grandparent, Tree.trimmed_id(upper_operator, [upper_id] + children_ids))
+
+def absorption_delta(nodes):
+    """ Returns the exact change in cost that `absorb(nodes)` followed by trimming would produce, without applying it. """
+    parent = nodes[0].parent
+    children_ids = [child.id for child in parent.children if child not in nodes]
+    return root_delta(parent, Tree.trimmed_id(parent.gate, children_ids))
+
+def distribution_delta(node1, node2):
+    """ Returns the exact change in cost that `distribute(node1, node2)` followed by trimming would produce, without applying it. """
+    parent = node1.parent
+    node2_id = Tree.trimmed_id(node2.gate, [Tree.trimmed_id(parent.gate, [node1.id, child.id]) for child in node2.children])
+    children_ids = [node2_id if child is node2 else child.id for child in parent.children if child is not node1]
+    return root_delta(parent, Tree.trimmed_id(parent.gate, children_ids))
+
+def apply(operation, tree, *args):
+    """ Applies `operation` (like `decrease_cost` or `increase_cost`) on `tree` in place while recording an undo journal.
+    The remaining arguments are passed to `operation` after `tree`.
+    The function returns the result of `operation` together with the journal, which can be passed to `Tree.undo` to reject the move.
+    """
+
+    Tree.journal = []
+    try:
+        result = operation(tree, *args)
+    finally:
+        journal = Tree.journal
+        Tree.journal = None
+    return result, journal
 
-def decrease_cost(tree):
-    """ Randomly applies a factorization or absorption operation on `tree` and then trims it.
+def decrease_cost(tree, table=None):
+    """ Randomly applies a factorization or absorption operation on `tree` and then trims the region it changed with `Tree.retrim`.
     The function returns a boolean indicating whether any operation could be applied or not.
     It guarantees that the new cost of the tree will not be greater than the initial one.
+    If `table` (a `TranspositionTable`) is given, it maps every state to the states reached from it by the moves drawn so far,
+    so a move drawn again in a known state is not applied, and `tree` is directly assigned the resulting state instead.
     """
 
-    lists1 = find_factorizable_lists(tree)
-    lists2 = find_absorbable_lists(tree)
-    if not lists1 and not lists2:
+    counts = count_candidates(tree.id)
+    if not counts[FACTORIZABLE] and not counts[ABSORBABLE]:
         return False
-    if lists1 and (not lists2 or random.random() < .5):
-        factorize(random.choice(lists1))
-    else:
-        absorb(random.choice(lists2))
-    tree.trim()
+    kind = FACTORIZABLE if counts[FACTORIZABLE] and (not counts[ABSORBABLE] or random.random() < .5) else ABSORBABLE
+    move = kind, random.randrange(counts[kind])
+    if table is not None:
+        id = tree.id
+        moves = table[id] if id in table else dict()
+        if move in moves:
+            tree.assign(Tree.from_id(moves[move]))
+            return True
+    Tree.retrim([factorize, absorb][kind](random_candidate(tree, *move)))
+    if table is not None:
+        moves[move] = tree.id
+        table[id] = moves
     return True
 
 def increase_cost(tree):
-    """ Randomly applies a distribution operation on `tree` and then trims it.
+    """ Randomly applies a distribution operation on `tree` and then trims the region it changed with `Tree.retrim`.
     The function returns a boolean indicating whether any operation could be applied or not.
     It does not guarantee that the new cost of the tree will not be lower than the initial one, because of the final trimming.
     """
 
-    nodes = find_distributable_nodes(tree)
-    if not nodes:
+    if not count_candidates(tree.id)[DISTRIBUTABLE]:
         return False
-    node = random.choice(nodes)
-    sibling = random.choice(list(set(node.parent.children) - {node}))
-    distribute(sibling, node)
-    tree.trim()
+    node = random_candidate(tree, DISTRIBUTABLE)
+    sibling = random.choice(sorted([child for child in node.parent.children if child is not node], key=lambda child: Tree.digests[child.id]))
+    Tree.retrim(distribute(sibling, node))
     return True
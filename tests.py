@@ -1,8 +1,21 @@
+import os
 import re
+import json
+import time
 import random
+import hashlib
+import tempfile
 import unittest
+import multiprocessing
 import operations
 import heuristics
+import equivalence
+import instrumentation
+import main
+from concurrent.futures import ProcessPoolExecutor
+from dag import Dag
+from pathlib import Path
+from cache import Cache
 from tree import Tree
 
 class TestTree(unittest.TestCase):
@@ -17,6 +30,17 @@ class TestTree(unittest.TestCase):
         self.assertEqual(Tree.parse('(a+b)(c+d)').formula, '((a+b)*(c+d))')
         self.assertEqual(Tree.parse('(a+b)*(c+d)').formula, '((a+b)*(c+d))')
         self.assertEqual(Tree.parse('((a+b)c)d').formula, '((a+b)*c*d)')
+        for formula in ['', 'a+', '+a', '()', '(a+)b', 'a*', '*a', 'a**b', 'a*+b', '(a', 'a)', ')(', 'a-b', 'a+b!']:
+            with self.assertRaises(ValueError):
+                Tree.parse(formula)
+
+    def test_parse_round_trip(self):
+        def test(tree):
+            copy = Tree.parse(tree.formula)
+            self.assertEqual(copy.id, tree.id)
+            self.assertEqual(str(copy), str(tree))
+            self.assertTrue(TestTree.validate_nodes(copy))
+        TestTree.for_random_tree(test)
 
     def test_formula_to_tree(self):
         tree = Tree.parse('a(b+c)')
@@ -42,18 +66,118 @@ class TestTree(unittest.TestCase):
         self.assertEqual(Tree.parse('abc').cost(), 3)
         self.assertEqual(Tree.parse('(ab+c)d+ad+c').cost(), 7)
 
+    def test_maintained_cost(self):
+        def test(tree):
+            operations.increase_cost(tree)
+            operations.decrease_cost(tree)
+            self.assertEqual(tree.cost(), sum([1 for char in tree.formula if char.isalpha()]))
+            for child in tree.children:
+                self.assertEqual(child.cost(), sum([1 for char in child.formula if char.isalpha()]))
+        TestTree.for_random_tree(test)
+
     def test_clone(self):
         tree = Tree.parse('a(b+c)')
         copy = tree.clone()
         self.assertEqual(str(tree), str(copy))
         self.assertTrue(TestTree.validate_nodes(copy))
 
+    def test_clone_independence(self):
+        def test(tree):
+            formula = tree.formula
+            copy = tree.clone()
+            operations.increase_cost(copy)
+            operations.decrease_cost(copy)
+            self.assertEqual(tree.formula, formula)
+            self.assertTrue(TestTree.validate_nodes(tree))
+            self.assertTrue(TestTree.validate_nodes(copy))
+        TestTree.for_random_tree(test)
+
+    def test_deep_formula(self):
+        depth = 5000
+        formula = 'c'
+        for level in range(depth):
+            formula = f'({"ab"[level % 2]}{"*+"[level % 2]}{formula})'
+        tree = Tree.parse(formula)
+        self.assertEqual(tree.cost(), depth + 1)
+        self.assertEqual(Tree.parse(tree.formula).id, tree.id)
+        self.assertEqual(str(tree).count('\n'), 2 * depth)
+        copy = tree.clone()
+        copy.trim()
+        self.assertEqual(copy.id, tree.id)
+        self.assertTrue(all(child.parent is node for node in copy.preorder() for child in node.children))
+        self.assertEqual(len(operations.find_absorbable_lists(copy)), operations.count_candidates(copy.id)[1])
+        operations.decrease_cost(copy)
+        self.assertTrue(Tree.probably_equivalent(tree, copy))
+        self.assertTrue(equivalence.equivalent(tree, copy))
+
+    def test_interned_variables(self):
+        tree = Tree.parse('x17(x17+b)')
+        leaf_ids = [id for id in Tree.keys[tree.id][1] if Tree.keys[id][0] == '?']
+        self.assertEqual(leaf_ids, [Tree('?', 'x17').id])
+        self.assertEqual(Tree.keys[leaf_ids[0]], ('?', Tree.variable('x17')))
+        self.assertEqual(Tree.variables[Tree.variable('x17')], 'x17')
+        self.assertFalse(hasattr(tree, '__dict__'))
+
+    def test_clear(self):
+        tree = Tree.parse('(ab+ac)(ab+ad)')
+        heuristics.naive(tree)
+        Tree.clear()
+        operations.clear_counts()
+        self.assertEqual((len(Tree.keys), len(Tree.ids), len(Tree.variables)), (0, 0, 0))
+        self.assertEqual(len(operations.subtree_counts), 0)
+        tree = Tree.parse('(ab+ac)(ab+ad)')
+        heuristics.naive(tree)
+        self.assertLess(tree.cost(), 8)
+        self.assertTrue(equivalence.equivalent(tree, Tree.parse('(ab+ac)(ab+ad)')))
+
     def test_random(self):
         def test(tree):
             self.assertTrue(TestTree.validate_nodes(tree))
             self.assertTrue(TestTree.check_invariants(tree))
         TestTree.for_random_tree(test, 10)
 
+    def test_random_sized(self):
+        for _ in range(10):
+            variable_count = random.randint(3, 100)
+            max_degree = random.randint(2, 25)
+            literal_count = random.randint(1, 1000)
+            tree = Tree.random_sized(variable_count, max_degree, literal_count)
+            self.assertEqual(tree.cost(), literal_count)
+            self.assertTrue(TestTree.validate_nodes(tree))
+            self.assertTrue(TestTree.check_invariants(tree))
+            self.assertEqual(Tree.parse(tree.formula).id, tree.id)
+            nodes = [tree]
+            while nodes:
+                node = nodes.pop()
+                self.assertLessEqual(len(node.children), max_degree)
+                nodes += node.children
+        self.assertRaises(ValueError, Tree.random_sized, 1, 2, 2)
+
+    def test_probably_equivalent(self):
+        self.assertTrue(Tree.probably_equivalent(Tree.parse('ab+ac'), Tree.parse('a(b+c)')))
+        self.assertTrue(Tree.probably_equivalent(Tree.parse('a+ab'), Tree.parse('a')))
+        self.assertFalse(Tree.probably_equivalent(Tree.parse('a+b'), Tree.parse('ab')))
+        self.assertFalse(Tree.probably_equivalent(Tree.parse('a+bcd'), Tree.parse('a')))
+
+    def test_equivalent(self):
+        for max_table_variables in [0, 16]:
+            self.assertTrue(equivalence.equivalent(Tree.parse('ab+ac'), Tree.parse('a(b+c)'), max_table_variables))
+            self.assertTrue(equivalence.equivalent(Tree.parse('(a+b)(a+c)'), Tree.parse('a+bc'), max_table_variables))
+            self.assertFalse(equivalence.equivalent(Tree.parse('a+b'), Tree.parse('ab'), max_table_variables))
+            self.assertFalse(equivalence.equivalent(Tree.parse('a+bcdefghijk'), Tree.parse('a'), max_table_variables))
+        for _ in range(10):
+            tree = Tree.random(random.randint(1, 30), random.randint(2, 10))
+            copy = tree.clone()
+            operations.increase_cost(copy)
+            operations.decrease_cost(copy)
+            self.assertTrue(equivalence.equivalent(tree, copy))
+            self.assertTrue(equivalence.equivalent(tree, copy, 0))
+        self.assertIsNone(equivalence.equivalent(Tree.parse('ab+cd+ef+gh'), Tree.parse('ab+cd+ef'), 0, 5))
+        literals = [Tree.literal(index) for index in range(1500)]
+        self.assertTrue(equivalence.equivalent(Tree.parse('+'.join(literals)), Tree.parse('+'.join(reversed(literals)) + '+a(b+c)')))
+        formula = f'({"+".join(literals)})({Tree.literal(1500)}+{Tree.literal(1501)})'
+        self.assertTrue(equivalence.equivalent(Tree.parse(formula), Tree.parse(f'{formula}+a{Tree.literal(1500)}')))
+
     @staticmethod
     def validate_nodes(node, parent=None):
         if node.parent is not parent:
@@ -75,6 +199,10 @@ class TestTree(unittest.TestCase):
             subformulas |= {child.formula}
         return len(subformulas) == len(node.children)
 
+    @staticmethod
+    def sample(values, count=3):
+        return random.sample(values, min(count, len(values)))
+
     @staticmethod
     def for_random_tree(callback, repeat=10):
         for _ in range(repeat):
@@ -89,6 +217,54 @@ class TestTree(unittest.TestCase):
         target = sorted([('a', 2), ('x', 3), ('x', 3), ('((t*x)+(x*y)+(x*z))', 2), ('(a+b)', 2)])
         self.assertListEqual(answer, target)
 
+    def test_count_candidates(self):
+        def test(tree):
+            operations.increase_cost(tree)
+            counts = operations.count_candidates(tree.id)
+            self.assertEqual(counts[operations.FACTORIZABLE], len(operations.find_factorizable_lists(tree)))
+            self.assertEqual(counts[operations.ABSORBABLE], len(operations.find_absorbable_lists(tree)))
+            self.assertEqual(counts[operations.DISTRIBUTABLE], len(operations.find_distributable_nodes(tree)))
+            if counts[operations.FACTORIZABLE]:
+                nodes = operations.random_candidate(tree, operations.FACTORIZABLE)
+                self.assertIn(nodes, operations.find_factorizable_lists(tree))
+        TestTree.for_random_tree(test)
+
+    def test_transposition_table(self):
+        table = operations.TranspositionTable(2)
+        table[1] = 'a'
+        table[2] = 'b'
+        self.assertEqual(table[1], 'a')
+        table[3] = 'c'
+        self.assertNotIn(2, table)
+        self.assertEqual((len(table), table[1], table[3]), (2, 'a', 'c'))
+        tree = Tree.parse('(ab+ac)(ab+ad)+abe')
+        table = operations.TranspositionTable()
+        heuristics.iterate(tree, heuristics.hill_climbing, 3, table)
+        self.assertEqual(tree.cost(), 4)
+        self.assertIn(Tree.parse('(ab+ac)(ab+ad)+abe').id, table)
+        def test(tree):
+            table = operations.TranspositionTable()
+            copies = [tree.clone() for _ in range(3)]
+            for copy, copy_table in zip(copies, [None, table, table]):
+                random.seed(618)
+                heuristics.hill_climbing(copy, table=copy_table)
+            self.assertEqual(len({copy.id for copy in copies}), 1)
+        TestTree.for_random_tree(test, 3)
+        subtree_counts = operations.subtree_counts
+        operations.subtree_counts = operations.TranspositionTable(50)
+        try:
+            tree = Tree.random(40, 5)
+            copy = tree.clone()
+            heuristics.simulated_annealing(copy)
+            self.assertEqual(operations.count_candidates(copy.id), tuple(map(len, [
+                operations.find_factorizable_lists(copy),
+                operations.find_absorbable_lists(copy),
+                operations.find_distributable_nodes(copy)
+            ])))
+        finally:
+            operations.subtree_counts = subtree_counts
+        self.assertTrue(equivalence.equivalent(copy, tree))
+
     def test_apply_factorization(self):
         tree = Tree.parse('(x*a*b*c)+(x*d*e)+(x*f)+g')
         operations.factorize(operations.find_factorizable_lists(tree)[0])
@@ -126,6 +302,30 @@ class TestTree(unittest.TestCase):
         tree.trim()
         self.assertEqual(tree.formula, '(((a*b)+(a*c)+(a*d*e))*f)')
 
+    def test_retrim(self):
+        def test(tree):
+            operations.increase_cost(tree)
+            for kind in [operations.FACTORIZABLE, operations.ABSORBABLE, operations.DISTRIBUTABLE]:
+                for index in TestTree.sample(range(operations.count_candidates(tree.id)[kind])):
+                    copies = [tree.clone(), tree.clone()]
+                    for copy in copies:
+                        candidate = operations.random_candidate(copy, kind, index)
+                        if kind == operations.FACTORIZABLE:
+                            nodes = operations.factorize(candidate)
+                        elif kind == operations.ABSORBABLE:
+                            nodes = operations.absorb(candidate)
+                        else:
+                            sibling = min([child for child in candidate.parent.children if child is not candidate], key=lambda child: Tree.digests[child.id])
+                            nodes = operations.distribute(sibling, candidate)
+                        if copy is copies[0]:
+                            Tree.retrim(nodes)
+                        else:
+                            copy.trim()
+                    self.assertEqual(copies[0].id, copies[1].id)
+                    self.assertTrue(TestTree.validate_nodes(copies[0]))
+                    self.assertTrue(TestTree.check_invariants(copies[0]))
+        TestTree.for_random_tree(test)
+
     def test_decrease_cost(self):
         def test(tree):
             old_cost = tree.cost()
@@ -158,6 +358,252 @@ class TestTree(unittest.TestCase):
             self.assertTrue(TestTree.check_invariants(tree))
         TestTree.for_random_tree(test)
 
+    def test_deltas(self):
+        def check(tree, delta, operation, *args):
+            old_cost = tree.cost()
+            expected = delta(*args)
+            _, journal = operations.apply(lambda tree: (operation(*args), tree.trim()), tree)
+            self.assertEqual(tree.cost() - old_cost, expected)
+            Tree.undo(journal)
+
+        def test(tree):
+            operations.increase_cost(tree)
+            for nodes in TestTree.sample(operations.find_factorizable_lists(tree)):
+                check(tree, operations.factorization_delta, operations.factorize, nodes)
+            for nodes in TestTree.sample(operations.find_absorbable_lists(tree)):
+                check(tree, operations.absorption_delta, operations.absorb, nodes)
+            for node in TestTree.sample(operations.find_distributable_nodes(tree)):
+                sibling = random.choice(list(set(node.parent.children) - {node}))
+                check(tree, operations.distribution_delta, operations.distribute, sibling, node)
+        TestTree.for_random_tree(test)
+
+    def test_undo(self):
+        def test(tree):
+            formula = str(tree)
+            for operation in [operations.increase_cost, operations.decrease_cost, operations.increase_cost]:
+                _, journal = operations.apply(operation, tree)
+                Tree.undo(journal)
+                self.assertEqual(str(tree), formula)
+                self.assertTrue(TestTree.validate_nodes(tree))
+        TestTree.for_random_tree(test)
+
+    def test_instrumentation(self):
+        reset = Tree.reset
+        tree = Tree.parse('(x*a*b*c)+(x*d*e)+(x*f)+g')
+        instrumentation.enable(memory=False)
+        instrumentation.clear()
+        old_time = time.perf_counter()
+        heuristics.naive(tree)
+        seconds = time.perf_counter() - old_time
+        snapshot = instrumentation.snapshot()
+        instrumentation.disable()
+        self.assertIs(Tree.reset, reset)
+        self.assertEqual(snapshot['calls']['operations.factorize'], 1)
+        self.assertGreater(snapshot['calls']['Tree.reset'], 0)
+        self.assertGreater(snapshot['seconds']['Tree.retrim'], 0)
+        self.assertGreater(snapshot['calls']['operations.count_candidates'], 0)
+        for names in instrumentation.GROUPS.values():
+            self.assertLessEqual(sum([snapshot['seconds'][name] for name in names]), seconds)
+        self.assertEqual(tree.formula, '((((a*b*c)+(d*e)+f)*x)+g)')
+
+    def test_cache(self):
+        cache = Cache(':memory:')
+        self.assertIsNone(cache.get('(a+(a*b))', 'naive', '618'))
+        cache.put('(a+(a*b))', 'naive', '618', None, (0, 1, '(a+(a*b))', True, None), 3)
+        cache.put('(a+(a*b))', 'naive', '619', None, (200 / 3, 1, 'a', True, None), 1)
+        cache.put('(a+(a*b))', 'naive', '620', None, (100, 1, 'b', False, None), 1)
+        self.assertEqual(cache.get('(a+(a*b))', 'naive', '618'), (0, 1, '(a+(a*b))', True, None))
+        self.assertIsNone(cache.get('(a+(a*b))', 'naive', '618', 'a'))
+        self.assertEqual(cache.best('(a+(a*b))'), 'a')
+        cache.close()
+        def heuristic(tree, steps=10, cost=Tree.cost):
+            pass
+        key = main.heuristic_key(heuristic)
+        self.assertTrue(key.startswith('heuristic/'))
+        self.assertNotIn('0x', key)
+        self.assertEqual(main.heuristic_key(heuristic, 2.5), key + '/2.5s')
+        heuristic.__defaults__ = (20, Tree.cost)
+        self.assertNotEqual(main.heuristic_key(heuristic), key)
+
+    @staticmethod
+    def make_dataset(path):
+        path.mkdir()
+        with open(path / 'small.txt', 'w') as fd:
+            fd.writelines([formula + '\n' for formula in ['ab+ac+ad+bc', '(a+b)(a+c)+bcd', 'abc+abd+ae+be', 'a+ab+(b+c)(b+d)']])
+        return path
+
+    def test_recovery(self):
+        with tempfile.TemporaryDirectory() as directory:
+            clean_path = TestTree.make_dataset(Path(directory) / 'clean')
+            clean_rows = main.run(clean_path, [heuristics.naive], iterations=2, workers=2)
+            clean_results = clean_path / 'results' / 'naive'
+            clean_formulas = main.read_lines(clean_results / 'small.txt')
+            clean_stats = main.read_lines(clean_results / 'small.stats')
+            self.assertEqual((len(clean_formulas), len(clean_stats)), (4, 4))
+
+            path = TestTree.make_dataset(Path(directory) / 'crashed')
+            results = path / 'results' / 'naive'
+            results.mkdir(parents=True)
+            with open(results / 'small.txt', 'w') as fd:
+                fd.writelines([clean_formulas[0], clean_formulas[1][0:3]])
+            with open(results / 'small.stats', 'w') as fd:
+                fd.writelines([clean_stats[0], clean_stats[1][0:3]])
+            formula, _ = main.canonical('(a+b)(a+c)+bcd')
+            seed = f'618/naive/{hashlib.sha256(formula.encode()).hexdigest()[0:16]}/0'
+            improvement, _, new_formula, certified, profile = main.run_iteration(heuristics.naive, formula, seed)
+            with open(results / 'small.runs.jsonl', 'w') as fd:
+                fd.write(json.dumps({'formula': 1, 'seed': seed, 'result': [improvement, 100, new_formula, certified, profile]}) + '\n')
+                fd.write('{"formula": 1, "seed": "618/na')
+            rows = main.run(path, [heuristics.naive], iterations=2, workers=2)
+            stats = main.read_lines(results / 'small.stats')
+            self.assertEqual(main.read_lines(results / 'small.txt'), clean_formulas)
+            self.assertEqual([line.split()[0:2] + line.split()[3:] for line in stats], [line.split()[0:2] + line.split()[3:] for line in clean_stats])
+            self.assertEqual(stats[0], clean_stats[0])
+            self.assertGreaterEqual(float(stats[1].split()[2]), 50)
+            self.assertEqual(rows[0][0:4] + rows[0][5:], clean_rows[0][0:4] + clean_rows[0][5:])
+            self.assertEqual(main.read_lines(results / 'small.runs.jsonl'), [])
+
+            def naive(tree):
+                raise AssertionError('nothing should run again')
+            self.assertEqual(main.run(path, [naive], iterations=2, workers=2), rows)
+            self.assertEqual(main.run(clean_path, [naive], iterations=2, workers=2), clean_rows)
+
+    @staticmethod
+    def read_results(path, shard=None):
+        results = main.results_directory(path, shard) / 'naive'
+        stats = [line.split()[0:2] + line.split()[3:] for line in main.read_lines(results / 'small.stats')]
+        return main.read_lines(results / 'small.txt'), stats
+
+    def test_sharding(self):
+        with tempfile.TemporaryDirectory() as directory:
+            clean_path = TestTree.make_dataset(Path(directory) / 'clean')
+            main.run(clean_path, [heuristics.naive], iterations=2, workers=2)
+            clean_results = TestTree.read_results(clean_path)
+
+            path = TestTree.make_dataset(Path(directory) / 'sharded')
+            workers = [multiprocessing.Process(target=main.work, args=(path, [heuristics.naive], 3), kwargs={'iterations': 2, 'workers': 1}) for _ in range(2)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            self.assertEqual([worker.exitcode for worker in workers], [0, 0])
+            queue_path = path / 'shards' / 'queue'
+            self.assertEqual(sorted(os.listdir(queue_path)), ['0-of-3.done', '1-of-3.done', '2-of-3.done', 'merge-of-3'])
+            self.assertFalse(main.work(path, [heuristics.naive], 3, iterations=2, workers=1))
+            main.merge_shards(path)
+            self.assertEqual(TestTree.read_results(path), clean_results)
+            self.assertFalse([name for _, _, names in os.walk(path) for name in names if name.endswith('.tmp')])
+
+            path = TestTree.make_dataset(Path(directory) / 'partial')
+            main.enqueue_shards(path, 3)
+            shard = main.claim_shard(path, 3)
+            main.run(path, [heuristics.naive], iterations=2, workers=2, shard=shard)
+            main.merge_shards(path)
+            indices = main.shard_indices('naive', 4, shard)
+            merged = 0
+            while merged in indices:
+                merged += 1
+            self.assertGreater(merged, 0)
+            self.assertEqual(TestTree.read_results(path), tuple([lines[0:merged] for lines in clean_results]))
+
+            shard_results = TestTree.read_results(path, shard)
+            self.assertEqual(len(shard_results[0]), 2)
+            queue_path = path / 'shards' / 'queue'
+            os.rename(queue_path / '{}-of-{}.claimed'.format(*shard), queue_path / '{}-of-{}.todo'.format(*shard))
+            self.assertEqual(main.claim_shard(path, 3), shard)
+            main.run(path, [heuristics.naive], iterations=2, workers=2, shard=shard)
+            self.assertEqual(TestTree.read_results(path, shard), shard_results)
+            self.assertEqual([main.claim_shard(path, 3), main.claim_shard(path, 3), main.claim_shard(path, 3)], [(1, 3), (2, 3), None])
+            main.run(path, [heuristics.naive], iterations=2, workers=2)
+            self.assertEqual(TestTree.read_results(path), clean_results)
+
+    def test_executor(self):
+        formula = '(ab+ac+ad)(ae+af)+(ab+bc)(bd+be)+ab(c+d)'
+        def run(function, **kwargs):
+            random.seed(618)
+            tree = Tree.parse(formula)
+            function(tree, **kwargs)
+            return tree.formula
+        for workers in [1, 2]:
+            with ProcessPoolExecutor(workers) as executor:
+                self.assertEqual(run(heuristics.hill_climbing, executor=executor), run(heuristics.hill_climbing))
+                self.assertEqual(run(heuristics.iterate, heuristic=heuristics.custom_heuristic, iterations=4, executor=executor), run(heuristics.iterate, heuristic=heuristics.custom_heuristic, iterations=4))
+                with self.assertRaises(ValueError):
+                    run(heuristics.hill_climbing, executor=executor, table=operations.TranspositionTable())
+
+    def test_budget(self):
+        tree = Tree.random(30, 5)
+        algorithms = [
+            heuristics.naive,
+            heuristics.hill_climbing,
+            heuristics.best_improvement_hill_climbing,
+            heuristics.simulated_annealing,
+            heuristics.custom_heuristic,
+            heuristics.parallel_tempering
+        ]
+        for algorithm in algorithms:
+            copy = tree.clone()
+            budget = heuristics.Budget(operations=5)
+            algorithm(copy, budget=budget)
+            self.assertEqual(copy.cost(), budget.best.cost())
+            self.assertEqual(budget.trace[0][1], tree.cost())
+            self.assertEqual(budget.trace[-1][1], copy.cost())
+            self.assertEqual([cost for _, cost in budget.trace], sorted({cost for _, cost in budget.trace}, reverse=True))
+            self.assertTrue(equivalence.equivalent(copy, tree))
+        results = []
+        with ProcessPoolExecutor(2) as executor:
+            for run_executor in [None, executor]:
+                random.seed(618)
+                copy = tree.clone()
+                budget = heuristics.Budget(operations=40)
+                heuristics.iterate(copy, heuristics.custom_heuristic, 4, executor=run_executor, budget=budget)
+                results += [(copy.formula, budget.used, budget.trace[-1][1])]
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][2], Tree.parse(results[0][0]).cost())
+
+    def test_budget_share(self):
+        state = random.getstate()
+        slots = []
+        def spend(tree, budget):
+            slots.append(budget.deadline - time.monotonic())
+            while not budget.step(tree):
+                pass
+        heuristics.iterate(Tree.parse('ab+ac'), spend, 4, budget=heuristics.Budget(seconds=.4))
+        random.setstate(state)
+        self.assertEqual(len(slots), 4)
+        self.assertTrue(all([0 < slot <= .4 / (4 - index) + .01 for index, slot in enumerate(slots)]))
+
+    def test_dag(self):
+        dag = Dag()
+        self.assertEqual(dag(Tree.parse('ab+ac')), 6)
+        self.assertEqual(dag.references[Tree.parse('a').id], 2)
+        self.assertEqual(dag(Tree.parse('a(b+c)')), 5)
+        self.assertNotIn(Tree.parse('ab').id, dag.references)
+        dag(Tree.parse('(a+b)c+(a+b)d'))
+        self.assertEqual(dag.shared(), [Tree.parse('a+b').id])
+        self.assertEqual(len(dag.netlist().split('\n')), 4)
+        self.assertEqual(Dag()(Tree.parse('a')), 1)
+
+        def test(tree):
+            dag = Dag()
+            copy = tree.clone()
+            for operation in [operations.increase_cost, operations.decrease_cost] * 3:
+                operation(copy)
+                self.assertEqual(dag(copy), Dag()(copy))
+            copy = tree.clone()
+            budget = heuristics.Budget(operations=50, cost=dag)
+            heuristics.simulated_annealing(copy, budget=budget, cost=dag)
+            self.assertEqual(dag(copy), budget.trace[-1][1])
+            self.assertLessEqual(dag(copy), Dag()(tree))
+            self.assertTrue(Tree.probably_equivalent(copy, tree))
+            copy = tree.clone()
+            heuristics.simulated_annealing(copy, cost=dag)
+            self.assertLessEqual(dag(copy), Dag()(tree))
+            copy = tree.clone()
+            heuristics.hill_climbing(copy, cost=dag)
+            self.assertLessEqual(dag(copy), Dag()(tree))
+        TestTree.for_random_tree(test, 3)
+
     def test_heuristics(self):
         variable_count = random.randint(20, 30)
         max_degree = random.randint(5, 10)
@@ -165,8 +611,10 @@ class TestTree(unittest.TestCase):
         algorithms = [
             heuristics.naive,
             heuristics.hill_climbing,
+            heuristics.best_improvement_hill_climbing,
             heuristics.simulated_annealing,
-            heuristics.custom_heuristic
+            heuristics.custom_heuristic,
+            heuristics.parallel_tempering
         ]
         for algorithm in algorithms:
             copy = tree.clone()
@@ -174,6 +622,7 @@ class TestTree(unittest.TestCase):
             self.assertTrue(TestTree.validate_nodes(copy))
             self.assertTrue(TestTree.check_invariants(copy))
             self.assertTrue(Tree.probably_equivalent(copy, tree))
+            self.assertTrue(equivalence.equivalent(copy, tree))
             copy = tree.clone()
             heuristics.iterate(copy, algorithm, 3)
             self.assertTrue(TestTree.validate_nodes(copy))
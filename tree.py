@@ -1,3 +1,5 @@
+import re
+import zlib
 import random
 
 class Tree:
@@ -5,13 +7,36 @@ class Tree:
     It stores the following data about the current node:
     1. `parent` which is `None` for the root
     2. `gate` the type of node, namely `'*'` for `AND`, `'+'` for `OR`, and `'?'` for `INPUT`
-    3. `children` the list of children, lexicographically ordered by their corresponding subformulas
-    4. `formula` the formula corresponding to the entire subtree; it respects the order of `children`
+    3. `children` the list of children, lexicographically ordered by their corresponding subformulas once `formula` is requested;
+    it is materialized lazily from `id` on the first access, which makes copies share all the untouched structure with the original
+    4. `id` an integer identifying the subformula of the entire subtree; structurally equal subtrees share the same `id`
+    5. `formula` the formula corresponding to the entire subtree; it is built lazily from `id` and respects the order of `children`
+
+    The nodes only hold these few fields in `__slots__`, since everything else about their subformulas lives in the class-level tables below.
+    The variables are interned too, `variables` mapping every integer variable id to its literal and `variable_ids` doing the converse.
+    The ids are hash-consed as well: the key of a leaf is `('?', variable id)`,
+    while the key of an inner node is its gate together with the sorted ids of its children.
+    Along with the key, each id stores the number of literals of its subformula, which is maintained incrementally when interning,
+    and a structural digest, which unlike the id itself does not depend on the history of the process, so it can order subformulas canonically.
+
+    While `journal` is a list, every change made to an existing node is recorded in it, so that it can be rolled back with `undo`.
     """
 
+    __slots__ = ('parent', 'gate', 'id', '_children', 'ordered')
+
+    variables = []
+    variable_ids = dict()
+    ids = dict()
+    keys = []
+    formulas = []
+    costs = []
+    digests = []
+    journal = None
+
     def __init__(self, gate, arg):
         """ Constructs a new tree by initializing its parent to `None` and calling `reset(gate, arg)`. """
         self.parent = None
+        self.id = None
         self.reset(gate, arg)
 
     def __str__(self):
@@ -19,132 +44,326 @@ class Tree:
         The formula is preceded by one `|` sign for each level of indentation.
         """
 
-        str_self = self.gate + ' ' + self.formula
-        if not self.children:
-            return str_self
-        str_children = '\n'.join([str(child) for child in self.children])
-        return '\n'.join([str_self] + ['| ' + line for line in str_children.split('\n')])
+        lines = []
+        stack = [(self, 0)]
+        while stack:
+            node, depth = stack.pop()
+            lines += ['| ' * depth + node.gate + ' ' + node.formula]
+            stack += [(child, depth + 1) for child in reversed(node.children)]
+        return '\n'.join(lines)
 
-    def reset(self, gate, arg):
+    def reset(self, gate, arg, propagate=True):
         """ Resets the contents of the node, except for the parent.
         If `gate == '?'`, then `arg` is the literal corresponding to the input.
         Otherwise, `arg` is the new list of children for the node.
-        When updating children, the formula is updated too, as well as the parents of the children.
+        When updating children, the id is updated too, as well as the parents of the children.
+        Unless `propagate` is unset, the ids of the ancestors are then updated by `propagate`.
         """
 
+        self.record()
         self.gate = gate
         if gate == '?':
             literal = arg
             self.children = []
-            self.formula = literal
+            self.id = Tree.intern(('?', Tree.variable(literal)))
         else:
             children = arg
-            children.sort(key=lambda child: child.formula)
             self.children = children
-            self.formula = '(' + gate.join([child.formula for child in children]) + ')'
+            self.id = Tree.intern((gate, tuple(sorted([child.id for child in children]))))
             for child in children:
+                if child.parent is not self:
+                    child.record()
+                    child.parent = self
+        self.ordered = gate == '?'
+        if propagate:
+            self.propagate()
+
+    def propagate(self):
+        """ Updates the ids of the ancestors of the node, from the bottom to the top, after the id of the node changed.
+        It stops at the first ancestor whose id does not change, since the ones above it are not affected.
+        """
+
+        node = self.parent
+        while node is not None:
+            id = Tree.intern((node.gate, tuple(sorted([child.id for child in node.children]))))
+            node.record()
+            node.ordered = False
+            if id == node.id:
+                break
+            node.id = id
+            node = node.parent
+
+    @property
+    def children(self):
+        """ Returns the list of children, building lazy nodes for them from `id` if they were not materialized yet.
+        If the formula of the node was already built, the new children are directly put in lexicographic order.
+        """
+
+        if self._children is None:
+            child_ids = Tree.keys[self.id][1]
+            if Tree.formulas[self.id] is not None:
+                child_ids = sorted(child_ids, key=Tree.formula_of)
+                self.ordered = True
+            self._children = [Tree.from_id(child_id) for child_id in child_ids]
+            for child in self._children:
                 child.parent = self
-        if self.parent is not None:
-            self.parent.reset(self.parent.gate, [*self.parent.children])
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
+
+    @property
+    def formula(self):
+        """ Returns the formula of the subtree and sorts `children` by their formulas if they changed since the last call. """
+        if not self.ordered and self._children is not None:
+            self._children = sorted(self._children, key=lambda child: child.formula)
+            self.ordered = True
+        return Tree.formula_of(self.id)
+
+    @staticmethod
+    def from_id(id):
+        """ Builds in constant time a parentless node for the subformula identified by `id`, whose children are materialized lazily. """
+        node = Tree.__new__(Tree)
+        node.parent = None
+        node.gate = Tree.keys[id][0]
+        node.id = id
+        node.children = [] if node.gate == '?' else None
+        node.ordered = node.gate == '?'
+        return node
+
+    @staticmethod
+    def variable(literal):
+        """ Returns the integer id of the variable `literal`, allocating a new one if the literal has never been seen before. """
+        variable_id = Tree.variable_ids.get(literal)
+        if variable_id is None:
+            variable_id = Tree.variable_ids[literal] = len(Tree.variables)
+            Tree.variables += [literal]
+        return variable_id
 
-    def assign(self, node):
-        """ Resets the contents of the node to those of `node`, except for the parent. """
-        self.reset(node.gate, node.formula if node.gate == '?' else node.children)
+    @staticmethod
+    def clear():
+        """ Empties the tables of interned variables and subformulas, which otherwise only grow, invalidating every existing tree and id.
+        Long-lived processes should call it between independent units of work, together with `operations.clear_counts`.
+        """
+
+        for table in [Tree.variables, Tree.variable_ids, Tree.ids, Tree.keys, Tree.formulas, Tree.costs, Tree.digests]:
+            table.clear()
+
+    @staticmethod
+    def intern(key):
+        """ Returns the id corresponding to `key`, allocating a new one if the key has never been seen before. """
+        id = Tree.ids.get(key)
+        if id is None:
+            id = Tree.ids[key] = len(Tree.keys)
+            Tree.keys += [key]
+            Tree.formulas += [Tree.variables[key[1]] if key[0] == '?' else None]
+            Tree.costs += [1 if key[0] == '?' else sum([Tree.costs[child_id] for child_id in key[1]])]
+            Tree.digests += [zlib.crc32(Tree.variables[key[1]].encode()) if key[0] == '?' else hash((key[0] == '*', *sorted([Tree.digests[child_id] for child_id in key[1]])))]
+        return id
+
+    @staticmethod
+    def formula_of(id):
+        """ Returns the formula corresponding to `id`, building and caching it on the first call, together with the missing formulas of its subformulas. """
+        if Tree.formulas[id] is None:
+            for missing_id in Tree.postorder([id], lambda id: Tree.formulas[id] is not None):
+                gate, ids = Tree.keys[missing_id]
+                Tree.formulas[missing_id] = '(' + gate.join(sorted([Tree.formulas[child_id] for child_id in ids])) + ')'
+        return Tree.formulas[id]
+
+    @staticmethod
+    def postorder(ids, known=lambda id: False):
+        """ Returns the ids of the subformulas of the formulas identified by `ids`, each of them once, and every one of them after the ids of its children.
+        The subformulas for which `known` returns `True` are left out, together with the ones only reachable through them.
+        The traversal uses an explicit stack, so the depth of the formulas is only bounded by the available memory.
+        """
+
+        order = []
+        visited = set()
+        stack = [(id, False) for id in ids]
+        while stack:
+            id, expanded = stack.pop()
+            if expanded:
+                order += [id]
+            elif id not in visited and not known(id):
+                visited |= {id}
+                stack += [(id, True)]
+                if Tree.keys[id][0] != '?':
+                    stack += [(child_id, False) for child_id in Tree.keys[id][1]]
+        return order
+
+    def preorder(self):
+        """ Returns the nodes of the tree in pre-order, materializing all of them; the traversal uses an explicit stack. """
+        nodes = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            nodes += [node]
+            stack += reversed(node.children)
+        return nodes
+
+    @staticmethod
+    def trimmed_id(gate, child_ids):
+        """ Returns the id of the node that `trim` would produce from a node with the given gate and trimmed children, without building it. """
+        ids = set()
+        for child_id in child_ids:
+            child_gate, grandchild_ids = Tree.keys[child_id]
+            if child_gate == gate:
+                ids |= set(grandchild_ids)
+            else:
+                ids |= {child_id}
+        if len(ids) == 1:
+            return ids.pop()
+        return Tree.intern((gate, tuple(sorted(ids))))
+
+    def assign(self, node, propagate=True):
+        """ Resets the contents of the node to those of `node`, except for the parent.
+        The children of `node` are left untouched, since the new ones are materialized lazily from its id.
+        Unless `propagate` is unset, the ids of the ancestors are then updated by `propagate`.
+        """
+
+        self.record()
+        self.gate = node.gate
+        self.id = node.id
+        self.children = [] if node.gate == '?' else None
+        self.ordered = node.gate == '?'
+        if propagate:
+            self.propagate()
+
+    def record(self):
+        """ Saves the current state of the node in `journal` if journaling is on and the node is not under construction. """
+        if Tree.journal is not None and self.id is not None:
+            children = None if self._children is None else [*self._children]
+            Tree.journal += [(self, self.parent, self.gate, self.id, children, self.ordered)]
+
+    @staticmethod
+    def undo(journal):
+        """ Rolls back the changes recorded in `journal`, restoring every touched node to its state from before the first record. """
+        for node, parent, gate, id, children, ordered in reversed(journal):
+            node.parent = parent
+            node.gate = gate
+            node.id = id
+            node.children = children
+            node.ordered = ordered
 
     def trim(self):
         """ Simplifies the tree by getting rid of the following three structural flaws:
         1. nodes with only one child `((a*b)) -> (a*b)`
         2. nodes with the same gate as their parent `(a+(b+c)) -> (a+b+c)`
         3. duplicate children `(a+a+b) -> (a+b)`
+
+        The nodes are simplified bottom-up in the reversed pre-order by `normalize`, so every node is handled after its (already simplified) children.
+        Since the ids of the ancestors are recomputed along the way, they are only propagated once at the end, above the trimmed subtree.
         """
 
-        subformulas = set()
-        new_children = []
+        for node in reversed(self.preorder()):
+            node.normalize()
+        self.propagate()
 
-        def update_children(child):
-            nonlocal subformulas, new_children
-            if child.formula not in subformulas:
-                subformulas |= {child.formula}
-                new_children += [child]
+    def normalize(self):
+        """ Gets rid of the structural flaws listed in `trim` at the node alone, assuming that its children are already trimmed.
+        The id of the node is updated, but not the ones of its ancestors.
+        """
 
+        if self.gate == '?':
+            return
+        subformulas = set()
+        new_children = []
         for child in self.children:
-            child.trim()
-            if child.gate == self.gate:
-                for grandchild in child.children:
-                    update_children(grandchild)
-            else:
-                update_children(child)
+            for new_child in child.children if child.gate == self.gate else [child]:
+                if new_child.id not in subformulas:
+                    subformulas |= {new_child.id}
+                    new_children += [new_child]
+        self.reset(self.gate, new_children, False)
+        if len(new_children) == 1:
+            self.assign(new_children[0], False)
 
-        self.reset(self.gate, self.formula if self.gate == '?' else new_children)
-        if len(self.children) == 1:
-            child = self.children[0]
-            self.assign(child)
+    @staticmethod
+    def retrim(nodes):
+        """ Trims the tree containing `nodes` after an edit that changed only them, everything else being trimmed already.
+        Only the given nodes and their ancestors can have structural flaws, so only they are simplified by `normalize`, the deepest ones first.
+        The cost is thus proportional to the size of the edit and the depth of the nodes, instead of the size of the whole tree.
+        """
+
+        depths = dict()
+        for node in nodes:
+            path = []
+            while node is not None and node not in depths:
+                path += [node]
+                node = node.parent
+            depth = -1 if node is None else depths[node]
+            for node in reversed(path):
+                depth += 1
+                depths[node] = depth
+        for node in sorted(depths, key=lambda node: -depths[node]):
+            node.normalize()
 
     def cost(self):
-        """ Returns the number of literals in the formula. """
-        return sum([1 for char in self.formula if char.isalpha()])
+        """ Returns the number of literals in the formula in constant time. """
+        return Tree.costs[self.id]
 
     def clone(self):
-        """ Returns a deep-copy of the tree by creating new nodes. """
-        if self.gate == '?':
-            return Tree(self.gate, self.formula)
-        return Tree(self.gate, [child.clone() for child in self.children])
+        """ Returns a copy of the tree in constant time.
+        The copy shares the interned structure with the original, and only the nodes visited or edited in it get materialized.
+        """
+
+        return Tree.from_id(self.id)
 
     @staticmethod
     def parse(string):
         """ Builds and returns the corresponding tree of the given formula.
-        Note that the rules for `string` are relaxed.
-        Thus, the first step of `parse` is normalizing the formula by making changes like the ones below.
+        Note that the rules for `string` are relaxed, so changes like the ones below are implicitly made.
         With that being said, the given formula still needs to be a valid one from a logical point of view.
         1. `a+b` becomes `(a+b)`
         2. `ab` becomes `(a*b)`
         3. `a(b+c)` becomes `(a*(b+c))`
+
+        The formula is tokenized and parsed in a single pass by a shift-reduce parser.
+        Its stack holds one frame for each open parenthesis, containing the terms read so far as lists of factor ids.
+        A closing parenthesis reduces its frame directly to the id of the trimmed subformula, so no trimming is needed afterwards.
+        The returned tree is materialized lazily.
+        It raises a `ValueError` for unknown characters, unbalanced parentheses, and empty terms or factors, like in `a+`, `()` or `a*+b`.
         """
 
-        formula = '('
-        for char in string:
-            last = formula[-1]
-            lhs = last == ')' or last.isalnum()
-            rhs = char == '(' or char.isalpha()
-            if lhs and rhs:
-                formula += '*'
-            formula += char
-        formula += ')'
-
-        operators = []
-        operands = []
-        for char in formula:
-            if char.isalpha():
-                operands += [Tree('?', char)]
-            elif char.isnumeric():
-                operands[-1].formula += char
-            else:
-                operators += [char]
-                if char == ')':
-                    sub_operators = []
-                    sub_operands = []
-                    while True:
-                        operator = operators.pop()
-                        if operator == '(':
-                            terms = []
-                            factors = [sub_operands.pop()]
-                            while sub_operands:
-                                if sub_operators.pop() == '*':
-                                    factors += [sub_operands.pop()]
-                                else:
-                                    terms += [Tree('*', factors)]
-                                    factors = [sub_operands.pop()]
-                            terms += [Tree('*', factors)]
-                            operands += [Tree('+', terms)]
-                            break
-                        operand = operands.pop()
-                        if operator != ')':
-                            sub_operators += [operator]
-                        sub_operands += [operand]
-
-        tree = operands[-1]
-        tree.trim()
-        return tree
+        def reduce(terms):
+            return Tree.trimmed_id('+', [Tree.trimmed_id('*', factors) for factors in terms])
+
+        stack = [[[]]]
+        factor_expected = False
+        for match in re.finditer(r'(?P<variable>[A-Za-z]\d*)|(?P<symbol>[()+*])|(?P<space>\s+)|(?P<unknown>.)', string):
+            token, position = match.group(), match.start()
+            if match.lastgroup == 'space':
+                continue
+            if match.lastgroup == 'unknown':
+                raise ValueError(f'unknown character {token!r} at position {position}')
+            if token in ['*', '+', ')'] and (factor_expected or token == '*' and not stack[-1][-1]):
+                raise ValueError(f'empty factor before position {position}')
+            if token == ')' and len(stack) == 1:
+                raise ValueError(f'unbalanced parenthesis at position {position}')
+            if token in ['+', ')'] and not stack[-1][-1]:
+                raise ValueError(f'empty term before position {position}')
+            factor_expected = token == '*'
+            if token == '(':
+                stack += [[[]]]
+            elif token == ')':
+                id = reduce(stack.pop())
+                stack[-1][-1] += [id]
+            elif token == '+':
+                stack[-1] += [[]]
+            elif token != '*':
+                stack[-1][-1] += [Tree.intern(('?', Tree.variable(token)))]
+        if factor_expected:
+            raise ValueError(f'empty factor before position {len(string)}')
+        if len(stack) > 1:
+            raise ValueError(f'unbalanced parenthesis at position {len(string)}')
+        if not stack[-1][-1]:
+            raise ValueError(f'empty term before position {len(string)}')
+        return Tree.from_id(reduce(stack.pop()))
+
+    @staticmethod
+    def literal(index):
+        """ Returns the name of the variable with the given index in the generated formulas, namely `a` to `z`, followed by `x1`, `x2`, etc. """
+        return chr(ord('a') + index) if index < 26 else 'x' + str(index - 25)
 
     @staticmethod
     def random(variable_count, max_degree):
@@ -153,54 +372,84 @@ class Tree:
         If the previous level has `n` nodes, then the current level (the one above it) will have `ceil(n / 2)` nodes.
         This way, it is guaranteed that each node on the previous level will have a parent.
         After assigning the parents for the previous level, it fills the remaining edges with clones of random existing nodes having opposite operators.
+        The whole construction is repeated until the trimmed tree respects `max_degree`.
+        """
+
+        while True:
+            levels = [[Tree('?', Tree.literal(i)) for i in range(variable_count)]]
+            while len(levels[-1]) > 1:
+                level_size = (len(levels[-1]) + 1) // 2
+                level_children = [[] for _ in range(level_size)]
+                for node in levels[-1]:
+                    index = random.choice([index for index in range(level_size) if len(level_children[index]) < max_degree])
+                    level_children[index] += [node]
+
+                level_operator = random.choice(list(set('*+') - {levels[-1][0].gate}))
+                available_nodes = sum(levels[-1:0:-2], []) + levels[0]
+
+                levels += [[]]
+                for index in range(level_size):
+                    available_children = list(set(available_nodes) - set(level_children[index]))
+                    available_max_degree = min(max_degree - len(level_children[index]), len(available_children))
+                    new_children_count = 0 if available_max_degree == 0 else random.randint(1, available_max_degree)
+                    level_children[index] += random.sample(available_children, new_children_count)
+                    children = [child if child.parent is None else child.clone() for child in level_children[index]]
+                    levels[-1] += [Tree(level_operator, children)]
+
+            tree = levels[-1][0]
+            tree.trim()
+            if max([len(node.children) for node in tree.preorder()]) <= max_degree:
+                return tree
+
+    @staticmethod
+    def random_sized(variable_count, max_degree, literal_count, attempts=100):
+        """ Generates and returns a random trimmed AST with exactly `literal_count` literals, drawn from `variable_count` variables,
+        such that no node in it has more than `max_degree` children.
+        Instead of sampling trees until one happens to have the right size, it builds the ids directly from the top:
+        the literals of every inner node are split at random among `2` to `max_degree` children of the opposite gate,
+        the children getting a single literal are distinct variables, and the others are built the same way.
+        Nothing can be flattened by trimming, so only the nodes with duplicate children need to be repaired by splitting them again,
+        at most `attempts` times each; a `ValueError` is raised if that is not enough, which happens when there are too few variables.
         """
 
-        levels = [[Tree('?', chr(ord('a') + i) if i < 26 else 'x' + str(i - 25)) for i in range(variable_count)]]
-        while len(levels[-1]) > 1:
-            level_size = (len(levels[-1]) + 1) // 2
-            level_children = [[] for _ in range(level_size)]
-            for node in levels[-1]:
-                index = random.choice([index for index in range(level_size) if len(level_children[index]) < max_degree])
-                level_children[index] += [node]
-
-            level_operator = random.choice(list(set('*+') - {levels[-1][0].gate}))
-            available_nodes = sum(levels[-1:0:-2], []) + levels[0]
-
-            levels += [[]]
-            for index in range(level_size):
-                available_children = list(set(available_nodes) - set(level_children[index]))
-                available_max_degree = min(max_degree - len(level_children[index]), len(available_children))
-                new_children_count = 0 if available_max_degree == 0 else random.randint(1, available_max_degree)
-                level_children[index] += random.sample(available_children, new_children_count)
-                children = [child if child.parent is None else child.clone() for child in level_children[index]]
-                levels[-1] += [Tree(level_operator, children)]
-
-        def compute_max_degree(node):
-            return max([len(node.children)] + [compute_max_degree(child) for child in node.children])
-
-        tree = levels[-1][0]
-        tree.trim()
-        return tree if compute_max_degree(tree) <= max_degree else Tree.random(variable_count, max_degree)
+        def build(gate, count):
+            if count == 1:
+                return Tree.intern(('?', Tree.variable(Tree.literal(random.randrange(variable_count)))))
+            for _ in range(attempts):
+                degree = random.randint(2, min(max_degree, count))
+                cuts = sorted(random.sample(range(1, count), degree - 1))
+                sizes = [end - begin for begin, end in zip([0] + cuts, cuts + [count])]
+                if sizes.count(1) > variable_count:
+                    continue
+                child_ids = [Tree.intern(('?', Tree.variable(Tree.literal(index)))) for index in random.sample(range(variable_count), sizes.count(1))]
+                child_ids += [build('+' if gate == '*' else '*', size) for size in sizes if size > 1]
+                if len(set(child_ids)) == len(child_ids):
+                    return Tree.intern((gate, tuple(sorted(child_ids))))
+            raise ValueError(f'could not build a formula with {literal_count} literals over {variable_count} variables')
+
+        return Tree.from_id(build(random.choice('*+'), literal_count))
 
     @staticmethod
     def probably_equivalent(tree1, tree2, iterations=1000):
-        """ Runs the given number of iterations in order to check if the formulas represented by `tree1` and `tree2` are equivalent.
-        At each iteration, the function randomly assigns truth values to every variable involved and checks the equality of the results.
+        """ Checks on the given number of random assignments if the formulas represented by `tree1` and `tree2` are equivalent.
+        All the assignments are evaluated at once: every variable gets a random `iterations`-bit integer, whose bits are its truth values,
+        and the gates are computed with bitwise operators in a single pass over the ids, each shared subformula being evaluated only once.
         """
 
-        for _ in range(iterations):
-            assignment = dict()
-
-            def evaluate(node):
-                nonlocal assignment
-                if node.gate == '*':
-                    return all(evaluate(child) for child in node.children)
-                if node.gate == '+':
-                    return any(evaluate(child) for child in node.children)
-                if node.formula not in assignment:
-                    assignment[node.formula] = random.random() < .5
-                return assignment[node.formula]
-
-            if evaluate(tree1) != evaluate(tree2):
-                return False
-        return True
+        mask = (1 << iterations) - 1
+        values = dict()
+        for id in Tree.postorder([tree1.id, tree2.id]):
+            gate, arg = Tree.keys[id]
+            if gate == '?':
+                values[id] = random.getrandbits(iterations)
+            elif gate == '*':
+                value = mask
+                for child_id in arg:
+                    value &= values[child_id]
+                values[id] = value
+            else:
+                value = 0
+                for child_id in arg:
+                    value |= values[child_id]
+                values[id] = value
+        return values[tree1.id] == values[tree2.id]